@@ -0,0 +1,103 @@
+import re
+import time
+import random
+
+import program.library.helpers as helpers
+
+from program.other.name_finder import Compare
+
+# usage: python3 -m benchmarks.basic_company_name --names 200000 --distinct 2000
+words = ['acme', 'blue', 'sky', 'bakery', 'north', 'widgets', 'global', 'green', 'energy', 'smith', 'and', 'sons', 'digital', 'media', 'solutions', 'london', 'uk', 'group', 'holdings', 'services']
+suffixes = ['', ' ltd', ' limited', ' llc', ' inc', ' co', ' pty ltd', ' corp']
+descriptions = ['', ' - Home', ' | Official Site', ', London', ' (UK)', ' - Plumbers & Heating Engineers']
+
+# how it worked before the patterns were compiled once
+def getBasicCompanyNameBefore(compare, s):
+    s = helpers.findBetween(s, '', '|')
+    s = helpers.findBetween(s, '', ' - ')
+    s = helpers.findBetween(s, '', ',')
+    s = helpers.findBetween(s, '', '(')
+
+    s = s.replace('-', ' ')
+    s = s.replace('&', ' ')
+
+    s = helpers.lettersNumbersAndSpacesOnly(s)
+    s = compare.getFuzzyVersion(s)
+
+    stringsToIgnore = [
+        'limited',
+        'ltd',
+        'llc',
+        'inc',
+        'pty',
+        'pl',
+        'co',
+        'corp'
+        'incorporated'
+    ]
+
+    for string in stringsToIgnore:
+        s = re.sub(f' {string} ', ' ', s)
+        s = re.sub(f' {string}$', '', s)
+
+    locationsToRemove = compare.options['ignoreInCompanyName'].split(',')
+
+    for string in locationsToRemove:
+        # an empty one removed everything after the first word. getIgnoreRegex skips them now.
+        if not string:
+            continue
+
+        s = re.sub(f' {string}.*', '', s)
+        s = re.sub(f' {string}$', '', s)
+
+    s = compare.getFuzzyVersion(s)
+
+    return s
+
+def getNames(count):
+    random.seed(1)
+
+    results = []
+
+    for i in range(0, count):
+        name = ' '.join(random.sample(words, random.randint(1, 4)))
+        name += random.choice(suffixes) + random.choice(descriptions)
+
+        if random.random() < 0.5:
+            name = name.title()
+
+        results.append(name)
+
+    return results
+
+def run(name, function, names):
+    started = time.monotonic()
+
+    for item in names:
+        function(item)
+
+    elapsed = time.monotonic() - started
+
+    print(f'{name}: {len(names)} names in {elapsed:.2f} seconds. {int(len(names) / elapsed)} names per second.')
+
+def main():
+    count = int(helpers.getParameter('--names', False, 200000))
+    distinct = int(helpers.getParameter('--distinct', False, 2000))
+
+    # the same names come up many times, like they do when comparing names for each domain
+    distinctNames = getNames(distinct)
+    names = [random.choice(distinctNames) for i in range(0, count)]
+
+    for ignoreInCompanyName in ['', 'london,uk']:
+        compare = Compare({'ignoreInCompanyName': ignoreInCompanyName})
+
+        differences = [item for item in distinctNames if compare.makeBasicCompanyName(item) != getBasicCompanyNameBefore(compare, item)]
+
+        print(f'ignoreInCompanyName "{ignoreInCompanyName}": {len(differences)} of {len(distinctNames)} names give a different result')
+
+        run('before', lambda item: getBasicCompanyNameBefore(compare, item), names)
+        run('compiled', compare.makeBasicCompanyName, names)
+        run('compiled and cached', Compare({'ignoreInCompanyName': ignoreInCompanyName}).getBasicCompanyName, names)
+
+if __name__ == '__main__':
+    main()
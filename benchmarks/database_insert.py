@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import json
+import tempfile
+import datetime
+
+import program.library.helpers as helpers
+
+from program.library.database import Database
+
+# usage: python3 -m benchmarks.database_insert --rows 1000000
+def getRows(count):
+    for i in range(0, count):
+        newItem = {
+            'domain': f'domain-{i}.co.uk',
+            'companyName': f'Company {i} Ltd',
+            'confidence': i % 100
+        }
+
+        yield {
+            'domain': newItem['domain'],
+            'companyName': newItem['companyName'],
+            'confidence': newItem['confidence'],
+            'gmDate': str(datetime.datetime.utcnow()),
+            'json': json.dumps(newItem)
+        }
+
+def run(name, count, options, batchSize=0):
+    directory = tempfile.mkdtemp()
+    database = Database(os.path.join(directory, 'benchmark.sqlite'), 'sqlite', options)
+    database.makeTables('program/resources/tables.json')
+
+    started = time.monotonic()
+
+    if batchSize:
+        batch = []
+
+        for row in getRows(count):
+            batch.append(row)
+
+            if len(batch) >= batchSize:
+                database.insertMany('result', batch)
+                batch = []
+
+        database.insertMany('result', batch)
+    else:
+        for row in getRows(count):
+            database.insert('result', row)
+
+    database.close()
+
+    elapsed = time.monotonic() - started
+
+    print(f'{name}: {count} rows in {elapsed:.1f} seconds. {int(count / elapsed)} rows per second.')
+
+    for fileName in os.listdir(directory):
+        os.remove(os.path.join(directory, fileName))
+
+    os.rmdir(directory)
+
+def main():
+    count = int(helpers.getParameter('--rows', False, 1000000))
+
+    # one commit per row is too slow to run for every row
+    slowCount = min(count, int(helpers.getParameter('--slowRows', False, 20000)))
+
+    run('insert, one transaction per row', slowCount, {'databaseBatchSize': 1})
+    run('insert, write behind of 100 rows', count, {'databaseBatchSize': 100, 'databaseBatchSeconds': 5})
+    run('insertMany, 10000 rows per call', count, {'databaseBatchSize': 1}, 10000)
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,385 @@
+import time
+
+# measured from here because the imports take some of the time
+started = time.monotonic()
+
 import sys
 import os
 import logging
 import datetime
+import threading
+import queue
+import asyncio
+import signal
 
 import program.library.helpers as helpers
 
 from program.library.helpers import get
 from program.library.database import Database
+from program.library.database import runInDatabaseThread
+from program.library.api import closeAsyncSessions
+from program.library.api import sessionPool
+from program.library.api import firstRequestTimer
+from program.library.cache import responseCache
+from program.library.cache import searchCache
+from program.library.cache import companyCache
+from program.library.retry_queue import RetryQueue
+from program.library.rate_limiter import rateLimiter
+from program.library.rate_limiter import googleLimiter
+from program.library.rate_limiter import companiesHouseBudget
+from program.library.other import proxyPool
+from program.library.other import proxyListCache
+from program.library.other import Internet
 from program.other.name_finder import NameFinder
+from program.other.name_finder import companiesHouseBatches
 
 class Main:
     def run(self):
         logging.info('Starting')
 
-        inputRows = helpers.getCsvFile(self.options['inputFile'], True, '\t')
+        try:
+            inputRows = helpers.readCsvFile(self.options['inputFile'], '\t')
 
-        while True:
-            self.nameFinder.captcha = False
-            
-            for i, inputRow in enumerate(inputRows):
+            if self.options['engine'] == 'asyncio':
+                asyncio.run(self.runTasks(inputRows))
+            elif self.options['workers'] > 1:
+                self.runWorkers(inputRows)
+            else:
+                self.runSequentially(inputRows)
+        finally:
+            # workers stop after their current domain
+            self.stopping.set()
+            proxyPool.stop()
+            self.cleanUp()
+
+    def handleSignal(self, signalNumber, frame):
+        logging.info('Stopping')
+
+        self.stopping.set()
+        proxyPool.stop()
+
+        # same as ctrl+c, so pending results still get written
+        raise KeyboardInterrupt
+
+    def runSequentially(self, inputRows):
+        for item in self.getDomainsToQueue(inputRows):
+            if self.stopping.is_set():
+                break
+
+            # interleave domains that hit a captcha with new ones
+            retry = self.retryQueue.getReady()
+
+            if retry:
+                self.findName(self.nameFinder, retry)
+
+            self.findName(self.nameFinder, item)
+
+        self.runRemainingRetries(self.nameFinder)
+
+    def runWorkers(self, inputRows):
+        # bounded so reading the input stays just ahead of the workers
+        domainQueue = queue.Queue(self.options['workers'] * 10)
+        self.threads = []
+
+        logging.info(f'Starting {self.options["workers"]} workers')
+
+        for i in range(0, self.options['workers']):
+            thread = threading.Thread(target=self.runWorker, args=(domainQueue,), name=f'worker-{i + 1}')
+            thread.start()
+            self.threads.append(thread)
+
+        for item in self.getDomainsToQueue(inputRows):
+            if not self.putInQueue(domainQueue, item):
+                break
+
+        for i in range(0, self.options['workers']):
+            # one stop signal per worker
+            self.putInQueue(domainQueue, None)
+
+        for thread in self.threads:
+            thread.join()
+
+    def putInQueue(self, domainQueue, item):
+        while not self.stopping.is_set():
+            try:
+                domainQueue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def runWorker(self, domainQueue):
+        # each worker needs its own connection and its own per-domain state
+        database = None
+        nameFinder = None
+
+        try:
+            database = Database(self.databaseFile, 'sqlite', self.options)
+            nameFinder = NameFinder(self.options, database, self.nameFinder.doneDomains, self.nameFinder.output)
+        except Exception as e:
+            helpers.handleException(e, 'Could not start worker')
+
+            if database:
+                database.close()
+
+            # the other workers take its domains
+            with self.failedWorkersLock:
+                self.failedWorkers += 1
+
+                if self.failedWorkers >= self.options['workers']:
+                    logging.error('No workers could start. Stopping.')
+                    self.stopping.set()
+
+            return
+
+        while not self.stopping.is_set():
+            item = self.retryQueue.getReady()
+
+            if not item:
                 try:
-                    domain = get(inputRow, 'domain')
-                    logging.info(f'Line {i + 1} of {len(inputRows)}: {domain}')
+                    # so it notices when the run is stopping
+                    item = domainQueue.get(timeout=1)
+                except queue.Empty:
+                    continue
+
+                if item == None:
+                    break
 
-                    self.nameFinder.findName(domain)
-                except Exception as e:
-                    helpers.handleException(e)
+            self.findName(nameFinder, item)
 
-            if not self.nameFinder.captcha:
+        self.runRemainingRetries(nameFinder)
+
+        database.close()
+
+    def findName(self, nameFinder, item):
+        i, domain = item
+
+        if not self.startDomain(domain):
+            return
+
+        try:
+            logging.info(f'Line {i + 1}: {domain}')
+
+            nameFinder.captcha = False
+            nameFinder.findName(domain)
+
+            self.afterFindName(nameFinder, item)
+        except Exception as e:
+            helpers.handleException(e)
+        finally:
+            self.finishDomain(domain)
+
+    def afterFindName(self, nameFinder, item):
+        i, domain = item
+
+        if nameFinder.captcha:
+            self.retryQueue.add(item, domain)
+        else:
+            self.retryQueue.finished(domain)
+
+    def runRemainingRetries(self, nameFinder):
+        while not self.stopping.is_set():
+            item = self.retryQueue.getReady()
+
+            if item:
+                self.findName(nameFinder, item)
+                continue
+
+            seconds = self.retryQueue.getSecondsUntilReady()
+
+            if seconds == None:
                 break
-            else:
-                logging.info('A captcha was found. Running again to finish any remaining lines.')
-        
-        self.cleanUp()
+
+            self.stopping.wait(min(seconds, 1))
+
+    async def runTasks(self, inputRows):
+        domainQueue = asyncio.Queue(self.options['workers'] * 10)
+
+        logging.info(f'Starting {self.options["workers"]} tasks')
+
+        tasks = [self.fillQueue(domainQueue, inputRows)]
+
+        for i in range(0, self.options['workers']):
+            tasks.append(self.runTask(domainQueue))
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await closeAsyncSessions()
+
+    async def fillQueue(self, domainQueue, inputRows):
+        # reading the input and checking the done list use the database thread
+        items = self.getDomainsToQueue(inputRows)
+
+        while not self.stopping.is_set():
+            item = await runInDatabaseThread(next, items, None)
+
+            if item == None:
+                break
+
+            await domainQueue.put(item)
+
+        for i in range(0, self.options['workers']):
+            # one stop signal per task
+            await domainQueue.put(None)
+
+    async def runTask(self, domainQueue):
+        # all tasks use the database from one thread, so they can share the connection
+        nameFinder = NameFinder(self.options, self.database, self.nameFinder.doneDomains, self.nameFinder.output)
+
+        while True:
+            item = self.retryQueue.getReady()
+
+            if not item:
+                item = await domainQueue.get()
+
+                if item == None:
+                    break
+
+            if self.stopping.is_set():
+                continue
+
+            await self.findNameAsync(nameFinder, item)
+
+        while not self.stopping.is_set():
+            item = self.retryQueue.getReady()
+
+            if item:
+                await self.findNameAsync(nameFinder, item)
+                continue
+
+            seconds = self.retryQueue.getSecondsUntilReady()
+
+            if seconds == None:
+                break
+
+            await asyncio.sleep(min(seconds, 1))
+
+    async def findNameAsync(self, nameFinder, item):
+        i, domain = item
+
+        if not self.startDomain(domain):
+            return
+
+        try:
+            logging.info(f'Line {i + 1}: {domain}')
+
+            nameFinder.captcha = False
+            await nameFinder.findNameAsync(domain)
+
+            self.afterFindName(nameFinder, item)
+        except Exception as e:
+            helpers.handleException(e)
+        finally:
+            self.finishDomain(domain)
+
+    def getDomainsToQueue(self, inputRows):
+        batch = []
+
+        for i, inputRow in enumerate(inputRows):
+            domain = get(inputRow, 'domain')
+
+            if not domain:
+                continue
+
+            batch.append((i, domain))
+
+            if len(batch) >= companiesHouseBatches.batchSize:
+                yield from self.startBatch(batch)
+
+                batch = []
+
+        yield from self.startBatch(batch)
+
+    # lets the next few domains share a companies house search
+    def startBatch(self, batch):
+        if companiesHouseBatches.batchSize <= 1:
+            return batch
+
+        domains = []
+
+        for i, domain in batch:
+            # they would take a place in the search for nothing
+            if self.nameFinder.doneDomains.contains(domain, self.database):
+                continue
+
+            if self.nameFinder.companiesHouseIndex.find(domain):
+                continue
+
+            domains.append(domain)
+
+        companiesHouseBatches.add(domains)
+
+        return batch
+
+    # so two workers never handle the same domain at once
+    def startDomain(self, domain):
+        with self.inProgressLock:
+            if domain in self.inProgress:
+                return False
+
+            self.inProgress.add(domain)
+
+        return True
+
+    def finishDomain(self, domain):
+        with self.inProgressLock:
+            self.inProgress.discard(domain)
+
+        # in case it was found without its batch
+        companiesHouseBatches.discard(domain)
 
     def cleanUp(self):
+        for thread in self.threads:
+            thread.join()
+
+        self.nameFinder.output.close()
+        self.database.close()
+
+        statistics = sessionPool.getStatistics()
+
+        logging.info(f'Connection pool: {statistics["hits"]} hits, {statistics["misses"]} misses, {statistics["handshakes"]} handshakes')
+
+        sessionPool.close()
+
+        if responseCache.enabled:
+            statistics = responseCache.getStatistics()
+
+            logging.info(f'Response cache: {statistics["hits"]} hits, {statistics["misses"]} misses')
+
+            responseCache.close()
+
+        if searchCache.enabled:
+            statistics = searchCache.getStatistics()
+
+            logging.info(f'Google results cache: {statistics["hits"]} hits ({statistics["noResultsHits"]} with no results), {statistics["misses"]} misses, {statistics["hitRate"]:.0%} hit rate')
+
+            searchCache.close()
+
+        if companyCache.enabled:
+            statistics = companyCache.getStatistics()
+
+            logging.info(f'Company page cache: {statistics["hits"]} hits, {statistics["misses"]} misses')
+
+            companyCache.close()
+
+        if companiesHouseBudget.enabled:
+            statistics = companiesHouseBudget.getStatistics()
+
+            logging.info(f'Companies House API: {statistics["requests"]} requests, {statistics["limited"]} times limited')
+
+        if googleLimiter.enabled:
+            googleLimiter.writeStatusIfDue(True)
+
+        if companiesHouseBatches.batchSize > 1:
+            statistics = companiesHouseBatches.getStatistics()
+
+            logging.info(f'Companies House batches: {statistics["searches"]} searches, {statistics["found"]} domains matched, {statistics["notFound"]} searched on their own')
+
+        for name, status in proxyPool.getStatus().items():
+            logging.info(f'Proxy {name}: {status["requests"]} requests, {status["captchas"]} captchas, {status["errors"]} errors, {status["seconds"]} seconds on average')
+
         logging.info('Done')
 
     def __init__(self, siteToRun='', modeToRun=''):
@@ -51,17 +396,105 @@ class Main:
             'userAvoidDomains': '',
             'ignoreInCompanyName': '',
             'minimumConfidence': 400,
-            'secondsBetweenLines': 0
+            'secondsBetweenLines': 0.0,
+            'workers': 1,
+            'engine': 'threads',
+            'connectionPoolSize': 10,
+            'connectionIdleSeconds': 60,
+            'cache': 0,
+            'cacheFile': 'user-data/cache.sqlite',
+            'cacheHours': 'default=168,*google.*=24',
+            'cacheMaximumMegabytes': 1000,
+            'doneSetMaximumSize': 5000000,
+            'databaseBatchSize': 100,
+            'databaseBatchSeconds': 5.0,
+            'databaseJournalMode': 'wal',
+            'databaseSynchronous': 'normal',
+            'outputBatchSize': 100,
+            'outputBatchSeconds': 5.0,
+            'outputFormats': 'csv',
+            'parquetRowGroupSize': 10000,
+            'captchaRetrySeconds': 60.0,
+            'captchaMaximumRetrySeconds': 3600.0,
+            'captchaMaximumAttempts': 10,
+            'rateLimits': '',
+            'googleAdaptiveLimits': 0,
+            'googleInitialRate': 0.5,
+            'googleMinimumRate': 0.05,
+            'googleMaximumRate': 5.0,
+            'googleRateIncrease': 0.02,
+            'googleInitialConcurrency': 2,
+            'googleMaximumConcurrency': 20,
+            'googleLimitsFile': 'user-data/logs/google-limits.json',
+            'proxyMaximumConcurrent': 2,
+            'proxyQuarantineSeconds': 300.0,
+            'proxyMaximumFailuresInARow': 3,
+            'proxyMaximumWaitSeconds': 60.0,
+            'proxyCacheFile': 'user-data/proxy-cache.json',
+            'proxyCacheHours': 6.0,
+            'searchCache': 0,
+            'searchCacheFile': 'user-data/search-cache.sqlite',
+            'searchCacheHours': 168.0,
+            'searchCacheNoResultsHours': 24.0,
+            'googleResultsPerPage': 10,
+            'googlePageConcurrency': 2,
+            'companiesHouseBatchSize': 1,
+            'companiesHouseBatchMinimumMatch': 0.8,
+            'companiesHouseIndexFile': 'user-data/companies-house.sqlite',
+            'companiesHouseIndexMinimumMatch': 0.8,
+            'companyCache': 1,
+            'companyCacheFile': 'user-data/company-cache.sqlite',
+            'companyCacheHours': 720.0,
+            'companiesHouseSource': 'google',
+            'companiesHouseApiKey': '',
+            'companiesHouseApiUrl': 'https://api.company-information.service.gov.uk',
+            'companiesHouseApiRequestsPerWindow': 600,
+            'companiesHouseApiWindowSeconds': 300.0,
+            'companiesHouseApiConcurrency': 4,
+            'companiesHouseApiMinimumMatch': 0.8
         }
 
+        # options that can have a fraction have float defaults, so they aren't read as integers
         optionsFileName = helpers.getParameter('--optionsFile', False, 'user-data/options.ini')
         
         # read the options file
         helpers.setOptions(optionsFileName, self.options)
 
+        self.options['workers'] = int(helpers.getParameter('--workers', False, self.options['workers']))
+        self.options['workers'] = max(self.options['workers'], 1)
+
+        sessionPool.configure(self.options)
+        firstRequestTimer.start(started)
+        responseCache.configure(self.options)
+        searchCache.configure(self.options)
+        companyCache.configure(self.options)
+
+        if self.options['companiesHouseSource'] == 'api':
+            companiesHouseBudget.configure(self.options, 'companiesHouseApi')
+
+        rateLimiter.configure(self.options)
+        googleLimiter.configure(self.options)
+        proxyPool.configure(self.options)
+        proxyListCache.configure(self.options)
+        companiesHouseBatches.configure(self.options)
+
         helpers.makeDirectory(os.path.dirname(self.options['outputFile']))
 
-        self.database = Database('user-data/database.sqlite')
+        self.stopping = threading.Event()
+        self.threads = []
+        self.inProgress = set()
+        self.inProgressLock = threading.Lock()
+        self.failedWorkers = 0
+        self.failedWorkersLock = threading.Lock()
+        self.retryQueue = RetryQueue(self.options)
+
+        signal.signal(signal.SIGTERM, self.handleSignal)
+
+        # the proxy list can download while the database loads. searches wait for it if they need it.
+        threading.Thread(target=Internet(self.options).loadProxies, name='proxies', daemon=True).start()
+
+        self.databaseFile = 'user-data/database.sqlite'
+        self.database = Database(self.databaseFile, 'sqlite', self.options)
         
         self.nameFinder = NameFinder(self.options, self.database)
 
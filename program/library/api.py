@@ -4,17 +4,25 @@ import os.path
 import random
 import json
 import urllib.parse
+import asyncio
+import threading
+import time
+import hashlib
 
 from collections import OrderedDict
+from contextlib import contextmanager
+
+# pip packages
+import requests
 
 from . import helpers
 
 from .helpers import get
+from .cache import responseCache
+from .rate_limiter import rateLimiter
 
 class Api:
-    def get(self, url, parameters=None, responseIsJson=True, returnResponseObject=False, requestType=None):
-        import requests
-
+    def get(self, url, parameters=None, responseIsJson=True, returnResponseObject=False, requestType=None, cache=False):
         result = ''
 
         if responseIsJson:
@@ -23,49 +31,110 @@ class Api:
         try:
             self.log.debug(f'Get {url}')
 
-            verify = True
-            
-            fileName = ''
-            
-            if '--debug' in sys.argv:
-                self.log.debug(f'Request headers: {self.headers}')
+            verify, fileName, cached = self.beforeGet(url, parameters, responseIsJson, returnResponseObject, requestType, cache)
 
-                if self.proxies and 'localhost:' in self.proxies.get('http', ''):
-                    verify = False
+            if cached != None:
+                return cached
 
-                fileName = self.getCacheFileName(url, parameters, responseIsJson)
+            rateLimiter.wait(self.urlPrefix + url)
 
-                if not returnResponseObject and not '--noCache' in sys.argv and os.path.exists(fileName):
-                    self.log.debug('Using cached version')
-                    result = helpers.getFile(fileName)
+            if self.budget:
+                self.budget.acquire()
 
-                    if responseIsJson:
-                        return json.loads(result)
-                    else:
-                        return result
+            response = None
 
-            if requestType == 'DELETE':
-                response = requests.delete(self.urlPrefix + url, params=parameters, headers=self.headers, proxies=self.proxies, timeout=self.timeout, verify=verify)
-            else:
-                response = requests.get(self.urlPrefix + url, params=parameters, headers=self.headers, proxies=self.proxies, timeout=self.timeout, verify=verify)
+            try:
+                with sessionPool.use(self.urlPrefix + url, self.proxies) as session:
+                    if requestType == 'DELETE':
+                        response = session.delete(self.urlPrefix + url, params=parameters, headers=self.headers, proxies=self.proxies, timeout=self.timeout, verify=verify)
+                    else:
+                        response = session.get(self.urlPrefix + url, params=parameters, headers=self.headers, proxies=self.proxies, timeout=self.timeout, verify=verify)
+            finally:
+                if self.budget:
+                    self.budget.finish(response)
 
             self.handleResponseLog(url, parameters, response, fileName)
+
+            firstRequestTimer.finish()
+
+            if cache and requestType != 'DELETE':
+                self.toResponseCache(url, parameters, response)
             
-            if returnResponseObject:
-                result = response
-            elif responseIsJson:
-                result = json.loads(response.text)
-            else:
-                result = response.text
+            result = self.getResult(response, responseIsJson, returnResponseObject)
         
         except Exception as e:
-            if 'Max retries exceeded with url' in str(e):
-                helpers.handleException(e, None, self.log.name, True)
-            else:
-                helpers.handleException(e, None, self.log.name)
+            self.handleRequestException(e)
         
         return result
 
+    # only pages that are safe to reuse use the response cache. proxy provider and ip address requests never do.
+    def beforeGet(self, url, parameters, responseIsJson, returnResponseObject, requestType=None, cache=False):
+        verify = True
+        fileName = ''
+        cached = None
+
+        if cache and requestType != 'DELETE' and not '--noCache' in sys.argv:
+            response = self.fromResponseCache(url, parameters)
+
+            if response != None:
+                return verify, fileName, self.getResult(response, responseIsJson, returnResponseObject)
+        
+        if '--debug' in sys.argv:
+            self.log.debug(f'Request headers: {self.headers}')
+
+            if self.proxies and 'localhost:' in self.proxies.get('http', ''):
+                verify = False
+
+            fileName = self.getCacheFileName(url, parameters, responseIsJson)
+
+            if not returnResponseObject and not '--noCache' in sys.argv and os.path.exists(fileName):
+                self.log.debug('Using cached version')
+                cached = helpers.getFile(fileName)
+
+                if responseIsJson:
+                    cached = json.loads(cached)
+
+        return verify, fileName, cached
+
+    def getResult(self, response, responseIsJson, returnResponseObject=False):
+        if returnResponseObject:
+            return response
+        elif responseIsJson:
+            return json.loads(response.text)
+        else:
+            return response.text
+
+    def fromResponseCache(self, url, parameters):
+        item = responseCache.get('GET', self.urlPrefix + url, parameters)
+
+        if not item:
+            return None
+
+        return ApiResponse(item['url'], item['statusCode'], item['headers'], item['content'], item['encoding'])
+
+    def toResponseCache(self, url, parameters, response):
+        if not responseCache.enabled or response == None:
+            return
+
+        # anything else might be temporary or fixed later, like a 429 or a 401 from a wrong key. 404 means it doesn't exist.
+        if response.status_code != 200 and response.status_code != 404:
+            return
+
+        if 'detected unusual traffic from your computer network.' in response.text:
+            return
+
+        # google maps next page isn't ready yet
+        if 'maps.google' in self.urlPrefix and 'INVALID_REQUEST' in response.text:
+            return
+
+        responseCache.put('GET', self.urlPrefix + url, parameters, response.url, response.status_code, response.headers, response.content, response.encoding or 'utf-8')
+
+    def handleRequestException(self, e):
+        if 'Max retries exceeded with url' in str(e):
+            helpers.handleException(e, None, self.log.name, True)
+        else:
+            helpers.handleException(e, None, self.log.name)
+
     def getPlain(self, url):
         result = self.get(url, None, False)
 
@@ -77,6 +146,9 @@ class Api:
 
         response = self.get(url, None, False, returnResponseObject=True)
 
+        return self.getFinalUrlFromResponse(url, response)
+
+    def getFinalUrlFromResponse(self, url, response):
         if not response:
             return ''
 
@@ -93,8 +165,6 @@ class Api:
         return result
 
     def post(self, url, data, responseIsJson=True):
-        import requests
-        
         result = {}
 
         if not responseIsJson:
@@ -103,33 +173,37 @@ class Api:
         try:
             self.log.debug(f'Post {url}')
 
-            verify = True
-            
-            fileName = ''
-            
-            if '--debug' in sys.argv:
-                self.log.debug(f'Request headers: {self.headers}')
-                self.log.debug(f'Request body: {data}')
-                
-                if self.proxies and 'localhost:' in self.proxies.get('http', ''):
-                    verify = False
-                
-                # don't want to read files for post, just write them
-                fileName = self.getCacheFileName(url, {}, responseIsJson)
+            verify, fileName = self.beforePost(url, data, responseIsJson)
+
+            rateLimiter.wait(self.urlPrefix + url)
 
-            response = requests.post(self.urlPrefix + url, headers=self.headers, proxies=self.proxies, data=data, timeout=self.timeout, verify=verify)
+            with sessionPool.use(self.urlPrefix + url, self.proxies) as session:
+                response = session.post(self.urlPrefix + url, headers=self.headers, proxies=self.proxies, data=data, timeout=self.timeout, verify=verify)
 
             self.handleResponseLog(url, {}, response, fileName)
 
-            if responseIsJson:
-                result = json.loads(response.text)
-            else:
-                result = response.text
+            result = self.getResult(response, responseIsJson)
         except Exception as e:
             helpers.handleException(e)
 
         return result
 
+    def beforePost(self, url, data, responseIsJson):
+        verify = True
+        fileName = ''
+        
+        if '--debug' in sys.argv:
+            self.log.debug(f'Request headers: {self.headers}')
+            self.log.debug(f'Request body: {data}')
+            
+            if self.proxies and 'localhost:' in self.proxies.get('http', ''):
+                verify = False
+            
+            # don't want to read files for post, just write them
+            fileName = self.getCacheFileName(url, {}, responseIsJson)
+
+        return verify, fileName
+
     def downloadBinaryFile(self, url, destinationFileName):       
         result = False
         
@@ -164,10 +238,12 @@ class Api:
             if parameters:
                 parameterString += '?' + urllib.parse.urlencode(parameters)
             
+            isNew = not os.path.exists(fileName)
+
             helpers.toBinaryFile(response.content, fileName)
 
             # avoid duplicates when using returnResponseObject
-            if not f' {self.urlPrefix}{url}{parameterString}' in helpers.getFile('user-data/logs/cache.txt'):
+            if isNew:
                 helpers.appendToFile(f'{fileName} {self.urlPrefix}{url}{parameterString}', 'user-data/logs/cache.txt')
         # normal log
         else:
@@ -186,36 +262,22 @@ class Api:
             helpers.toBinaryFile(response.content, fileName)
 
     def getCacheFileName(self, url, parameters, responseIsJson):
-        result = ''
-
-        file = helpers.getFile('user-data/logs/cache.txt')
-
         urlToFind = self.urlPrefix + url
        
         if parameters:
             urlToFind += '?' + urllib.parse.urlencode(parameters)
 
-        for line in file.splitlines():
-            fileName = helpers.findBetween(line, '', ' ')
-            lineUrl = helpers.findBetween(line, ' ', '')
-
-            if lineUrl == urlToFind:
-                result = fileName
-                break
-
-        if not result:
-            fileName = helpers.lettersAndNumbersOnly(url)
-            fileName = fileName[0:25]
-            
-            for i in range(0, 16):  
-                fileName += str(random.randrange(0, 10))
-            
-            extension = 'json'
+        # same url always gets the same file
+        fileName = helpers.lettersAndNumbersOnly(url)
+        fileName = fileName[0:25]
+        fileName += hashlib.sha1(urlToFind.encode('utf-8')).hexdigest()[0:16]
+        
+        extension = 'json'
 
-            if not responseIsJson:
-                extension = 'html'
+        if not responseIsJson:
+            extension = 'html'
 
-            result = f'user-data/logs/cache/{fileName}.{extension}'
+        result = f'user-data/logs/cache/{fileName}.{extension}'
 
         helpers.makeDirectory('user-data/logs/cache')
 
@@ -255,8 +317,14 @@ class Api:
         return result
 
     def setHeadersFromHarFile(self, fileName, urlMustContain):
+        headers = self.getHeadersOnce((fileName, urlMustContain, self.hasBrotli), lambda: self.readHeadersFromHarFile(fileName, urlMustContain))
+
+        if headers != None:
+            self.headers = headers
+
+    def readHeadersFromHarFile(self, fileName, urlMustContain):
         if not os.path.exists(fileName):
-            return
+            return None
 
         try:
             from pathlib import Path
@@ -304,11 +372,26 @@ class Api:
 
                 headers.append(newHeader)
 
-            self.headers = OrderedDict(headers)
+            return OrderedDict(headers)
         
         except Exception as e:
             helpers.handleException(e)
 
+        return None
+
+    # each file is read once. every api object gets its own copy.
+    def getHeadersOnce(self, key, read):
+        with headersFilesLock:
+            if not key in headersFiles:
+                headersFiles[key] = read()
+
+            headers = headersFiles[key]
+
+        if headers == None:
+            return None
+
+        return OrderedDict(headers)
+
     def getHeadersFromFile(self, fileName):
         file = helpers.getFile(fileName)
 
@@ -338,7 +421,9 @@ class Api:
     def randomizeHeaders(self):
         number = random.randrange(1, 2)
 
-        self.headers = self.getHeadersFromFile(f'resources/headers-{number}.txt')
+        fileName = f'resources/headers-{number}.txt'
+
+        self.headers = self.getHeadersOnce((fileName,), lambda: self.getHeadersFromFile(fileName))
 
     def __init__(self, urlPrefix='', options=None):
         self.urlPrefix = urlPrefix
@@ -362,10 +447,335 @@ class Api:
             ])
 
         self.proxies = None
-        self.hasBrotli = True
+        self.hasBrotli = checkBrotli()
+
+        # limits requests per window, for apis that have one
+        self.budget = None
+
+class SessionPool:
+    # keeps connections open between requests to the same host through the same proxy
+    @contextmanager
+    def use(self, url, proxies):
+        key = self.getKey(url, proxies)
+
+        with self.lock:
+            self.evictIdle()
+
+            item = self.sessions.get(key)
+
+            if item:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+                item = {
+                    'session': self.newSession(),
+                    'active': 0
+                }
+
+                self.sessions[key] = item
+
+            item['active'] += 1
+            item['lastUsed'] = time.monotonic()
+
+        try:
+            yield item['session']
+        finally:
+            with self.lock:
+                item['active'] -= 1
+                item['lastUsed'] = time.monotonic()
+
+                # behave like separate requests did before
+                if not item['active']:
+                    item['session'].cookies.clear()
+
+    def getKey(self, url, proxies):
+        parsed = urllib.parse.urlparse(url)
+
+        proxy = ''
+
+        if proxies:
+            proxy = proxies.get(parsed.scheme, '') or proxies.get('http', '')
+
+        return (f'{parsed.scheme}://{parsed.netloc}', proxy)
+
+    def newSession(self):
+        session = requests.Session()
+
+        # a few pools in case of redirects to another host or protocol
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=self.poolSize)
+
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        return session
+
+    def evictIdle(self):
+        now = time.monotonic()
+
+        for key, item in list(self.sessions.items()):
+            if item['active'] or now - item['lastUsed'] < self.idleSeconds:
+                continue
+
+            self.closeSession(key)
+
+    def closeSession(self, key):
+        item = self.sessions.pop(key)
+
+        # otherwise the count for this session would be lost
+        self.closedHandshakes += self.getHandshakes(item['session'])
+
+        item['session'].close()
 
+    def getHandshakes(self, session):
+        result = 0
+
+        adapters = {}
+
+        for adapter in session.adapters.values():
+            adapters[id(adapter)] = adapter
+
+        for adapter in adapters.values():
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+
+            for manager in managers:
+                for key in list(manager.pools.keys()):
+                    pool = manager.pools.get(key)
+
+                    # each new connection is a tcp handshake plus tls for https
+                    result += getattr(pool, 'num_connections', 0)
+
+        return result
+
+    def getStatistics(self):
+        with self.lock:
+            handshakes = self.closedHandshakes
+
+            for item in self.sessions.values():
+                handshakes += self.getHandshakes(item['session'])
+
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'handshakes': handshakes,
+                'openSessions': len(self.sessions)
+            }
+
+    def configure(self, options):
+        self.poolSize = int(options.get('connectionPoolSize', self.poolSize))
+        self.idleSeconds = int(options.get('connectionIdleSeconds', self.idleSeconds))
+
+    def close(self):
+        with self.lock:
+            for key in list(self.sessions.keys()):
+                self.closeSession(key)
+
+    def __init__(self, poolSize=10, idleSeconds=60):
+        self.poolSize = poolSize
+        self.idleSeconds = idleSeconds
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.closedHandshakes = 0
+
+# shared by all Api objects
+sessionPool = SessionPool()
+
+class FirstRequestTimer:
+    # how long it took from starting the program until the first request over the network finished
+    def finish(self):
+        if self.logged or self.started == None:
+            return
+
+        with self.lock:
+            if self.logged:
+                return
+
+            self.logged = True
+
+        logging.info(f'Time to first request: {time.monotonic() - self.started:.2f} seconds')
+
+    def start(self, started):
+        self.started = started
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = None
+        self.logged = False
+
+firstRequestTimer = FirstRequestTimer()
+
+headersFiles = {}
+headersFilesLock = threading.Lock()
+
+brotliChecked = None
+
+# only checks and warns once
+def checkBrotli():
+    global brotliChecked
+
+    if brotliChecked == None:
         try:
             import brotli
+
+            brotliChecked = True
         except ImportError as e:
-            self.hasBrotli = False
-            helpers.handleException(e, 'You should run "pip3 install brotli" or "pip install brotli" first, then restart this script')
\ No newline at end of file
+            brotliChecked = False
+            helpers.handleException(e, 'You should run "pip3 install brotli" or "pip install brotli" first, then restart this script')
+
+    return brotliChecked
+
+class AsyncApi(Api):
+    async def get(self, url, parameters=None, responseIsJson=True, returnResponseObject=False, requestType=None, cache=False):
+        result = ''
+
+        if responseIsJson:
+            result = {}
+
+        try:
+            self.log.debug(f'Get {url}')
+
+            # the response cache and the log files are on disk
+            verify, fileName, cached = await asyncio.to_thread(self.beforeGet, url, parameters, responseIsJson, returnResponseObject, requestType, cache)
+
+            if cached != None:
+                return cached
+
+            method = 'GET'
+
+            if requestType == 'DELETE':
+                method = 'DELETE'
+
+            response = await self.request(method, url, parameters, None, verify)
+
+            await asyncio.to_thread(self.handleResponseLog, url, parameters, response, fileName)
+
+            firstRequestTimer.finish()
+
+            if cache and requestType != 'DELETE':
+                await asyncio.to_thread(self.toResponseCache, url, parameters, response)
+            
+            result = self.getResult(response, responseIsJson, returnResponseObject)
+        
+        except Exception as e:
+            self.handleRequestException(e)
+        
+        return result
+
+    async def getPlain(self, url):
+        result = await self.get(url, None, False)
+
+        return result
+
+    async def getFinalUrl(self, url):
+        if not url:
+            return ''
+
+        response = await self.get(url, None, False, returnResponseObject=True)
+
+        return self.getFinalUrlFromResponse(url, response)
+
+    async def post(self, url, data, responseIsJson=True):
+        result = {}
+
+        if not responseIsJson:
+            result = ''
+
+        try:
+            self.log.debug(f'Post {url}')
+
+            verify, fileName = self.beforePost(url, data, responseIsJson)
+
+            response = await self.request('POST', url, None, data, verify)
+
+            self.handleResponseLog(url, {}, response, fileName)
+
+            result = self.getResult(response, responseIsJson)
+        except Exception as e:
+            helpers.handleException(e)
+
+        return result
+
+    async def request(self, method, url, parameters, data, verify):
+        import aiohttp
+
+        fullUrl = self.urlPrefix + url
+
+        await rateLimiter.waitAsync(fullUrl)
+
+        proxy = None
+
+        if self.proxies:
+            if fullUrl.startswith('https:'):
+                proxy = self.proxies.get('https', '')
+            else:
+                proxy = self.proxies.get('http', '')
+
+        # aiohttp only accepts strings
+        if parameters:
+            parameters = {key: str(value) for key, value in parameters.items()}
+
+        ssl = None
+
+        if not verify:
+            ssl = False
+
+        session = await getAsyncSession()
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        if self.budget:
+            await self.budget.acquireAsync()
+
+        result = None
+
+        try:
+            async with session.request(method, fullUrl, params=parameters, data=data, headers=self.headers, proxy=proxy or None, timeout=timeout, ssl=ssl) as response:
+                content = await response.read()
+
+                result = ApiResponse(str(response.url), response.status, response.headers, content, response.get_encoding())
+        finally:
+            if self.budget:
+                self.budget.finish(result)
+
+        return result
+
+class ApiResponse:
+    # the parts of requests.Response that the rest of the code uses
+    def __bool__(self):
+        return self.ok
+
+    def __init__(self, url, statusCode, headers, content, encoding):
+        self.url = url
+        self.status_code = statusCode
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.ok = statusCode < 400
+        self.text = content.decode(encoding or 'utf-8', errors='replace')
+
+# one session per event loop so all requests share its connections
+asyncSessions = {}
+
+async def getAsyncSession():
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+
+    session = asyncSessions.get(loop)
+
+    if not session or session.closed:
+        # headers are set per request
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        asyncSessions[loop] = session
+
+    return session
+
+async def closeAsyncSessions():
+    loop = asyncio.get_running_loop()
+
+    session = asyncSessions.pop(loop, None)
+
+    if session:
+        await session.close()
@@ -0,0 +1,373 @@
+import os
+import logging
+import sqlite3
+import threading
+import time
+import json
+import zlib
+import hashlib
+import fnmatch
+import re
+import urllib.parse
+
+from . import helpers
+
+from .helpers import get
+
+class ResponseCache:
+    def get(self, method, url, parameters):
+        if not self.enabled:
+            return None
+
+        key = self.getKey(method, url, parameters)
+
+        with self.lock:
+            row = self.connection.execute('select * from response where key = ?', (key,)).fetchone()
+
+            if not row:
+                self.misses += 1
+                return None
+
+            now = time.time()
+
+            if row['expires'] < now:
+                self.misses += 1
+                self.delete(key, row['size'])
+                return None
+
+            self.hits += 1
+
+            self.connection.execute('update response set lastUsed = ? where key = ?', (now, key))
+            self.connection.commit()
+
+        self.log.debug(f'Using cached response for {url}')
+
+        return {
+            'url': row['finalUrl'],
+            'statusCode': row['statusCode'],
+            'headers': json.loads(row['headers']),
+            'content': zlib.decompress(row['content']),
+            'encoding': row['encoding']
+        }
+
+    def put(self, method, url, parameters, finalUrl, statusCode, headers, content, encoding):
+        if not self.enabled or content == None:
+            return
+
+        seconds = self.getSecondsToKeep(url)
+
+        if seconds <= 0:
+            return
+
+        key = self.getKey(method, url, parameters)
+        compressed = zlib.compress(content)
+        now = time.time()
+
+        with self.lock:
+            row = self.connection.execute('select size from response where key = ?', (key,)).fetchone()
+
+            if row:
+                self.size -= row['size']
+
+            self.connection.execute('insert or replace into response (key, url, finalUrl, statusCode, headers, encoding, content, size, expires, lastUsed) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, url, finalUrl, statusCode, json.dumps(dict(headers)), encoding, compressed, len(compressed), now + seconds, now))
+
+            self.size += len(compressed)
+
+            self.evict()
+
+            self.connection.commit()
+
+    def getKey(self, method, url, parameters):
+        parameterString = ''
+
+        if parameters:
+            parameterString = urllib.parse.urlencode(sorted(parameters.items()))
+
+        return hashlib.sha1(f'{method} {url} {parameterString}'.encode('utf-8')).hexdigest()
+
+    def getSecondsToKeep(self, url):
+        host = urllib.parse.urlparse(url).netloc.lower()
+
+        # first matching pattern wins
+        for pattern, hours in self.hoursToKeep:
+            if fnmatch.fnmatch(host, pattern):
+                return hours * 3600
+
+        return self.defaultHoursToKeep * 3600
+
+    def evict(self):
+        if self.size <= self.maximumSize:
+            return
+
+        # remove least recently used until well under the limit
+        target = int(self.maximumSize * 0.9)
+
+        rows = self.connection.execute('select key, size from response order by lastUsed').fetchall()
+
+        for row in rows:
+            if self.size <= target:
+                break
+
+            self.delete(row['key'], row['size'])
+
+    def delete(self, key, size):
+        self.connection.execute('delete from response where key = ?', (key,))
+        self.size -= size
+
+    def getStatistics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes': self.size
+        }
+
+    def configure(self, options):
+        self.enabled = bool(get(options, 'cache'))
+
+        if not self.enabled:
+            return
+
+        self.maximumSize = int(get(options, 'cacheMaximumMegabytes') or 1000) * 1000 * 1000
+
+        # for example: default=168,*google.*=24,beta.companieshouse.gov.uk=720
+        for item in str(get(options, 'cacheHours')).split(','):
+            pattern = helpers.findBetween(item, '', '=').strip().lower()
+            hours = helpers.findBetween(item, '=', '', True).strip()
+
+            if not pattern or not hours:
+                continue
+
+            if pattern == 'default':
+                self.defaultHoursToKeep = float(hours)
+            else:
+                self.hoursToKeep.append((pattern, float(hours)))
+
+        self.open(get(options, 'cacheFile') or 'user-data/cache.sqlite')
+
+    def open(self, fileName):
+        helpers.makeDirectory(os.path.dirname(fileName) or '.')
+
+        # workers use the same connection
+        self.connection = sqlite3.connect(fileName, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        self.connection.execute('create table if not exists response ( key text, url text, finalUrl text, statusCode integer, headers text, encoding text, content blob, size integer, expires real, lastUsed real, primary key(key) )')
+        self.connection.execute('create index if not exists responseLastUsed on response (lastUsed)')
+        self.connection.commit()
+
+        row = self.connection.execute('select sum(size) as size from response').fetchone()
+
+        self.size = row['size'] or 0
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+        self.enabled = False
+
+    def __init__(self):
+        self.enabled = False
+        self.connection = None
+        self.lock = threading.Lock()
+        self.log = logging.getLogger()
+        self.size = 0
+        self.maximumSize = 1000 * 1000 * 1000
+        self.defaultHoursToKeep = 168
+        self.hoursToKeep = []
+        self.hits = 0
+        self.misses = 0
+
+# shared by all Api objects
+responseCache = ResponseCache()
+
+class SearchCache:
+    # keeps the urls found on each Google results page, not the page itself. "no results" is kept too, for less time.
+    def get(self, parameters, mode=''):
+        if not self.enabled:
+            return False, None
+
+        key = self.getKey(parameters, mode)
+
+        with self.lock:
+            row = self.connection.execute('select urls, expires from search where key = ?', (key,)).fetchone()
+
+            if not row or row['expires'] < time.time():
+                self.misses += 1
+                return False, None
+
+            self.hits += 1
+
+            if row['urls'] == None:
+                self.noResultsHits += 1
+                return True, None
+
+        return True, json.loads(row['urls'])
+
+    # urls is none if there were no results
+    def put(self, parameters, urls, mode=''):
+        if not self.enabled:
+            return
+
+        hours = self.hours
+
+        if urls == None:
+            hours = self.noResultsHours
+        else:
+            urls = json.dumps(urls)
+
+        if hours <= 0:
+            return
+
+        with self.lock:
+            self.connection.execute('insert or replace into search (key, query, urls, expires) values (?, ?, ?, ?)',
+                (self.getKey(parameters, mode), self.getQuery(parameters), urls, time.time() + hours * 3600))
+
+            self.connection.commit()
+
+    # same query with different case or spacing gets the same key. the mode says what was kept from the page.
+    def getKey(self, parameters, mode=''):
+        items = []
+
+        if mode:
+            items.append(f'mode={mode}')
+
+        for name, value in sorted(parameters.items()):
+            if name == 'q':
+                value = self.getQuery(parameters)
+
+            items.append(f'{name}={value}')
+
+        return hashlib.sha1('&'.join(items).encode('utf-8')).hexdigest()
+
+    def getQuery(self, parameters):
+        return re.sub(r'\s+', ' ', str(get(parameters, 'q'))).strip().lower()
+
+    def getStatistics(self):
+        total = self.hits + self.misses
+        hitRate = 0
+
+        if total:
+            hitRate = self.hits / total
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'noResultsHits': self.noResultsHits,
+            'hitRate': hitRate
+        }
+
+    def configure(self, options):
+        self.enabled = bool(get(options, 'searchCache'))
+
+        if not self.enabled:
+            return
+
+        self.hours = float(get(options, 'searchCacheHours') or 0)
+        self.noResultsHours = float(get(options, 'searchCacheNoResultsHours') or 0)
+
+        self.open(get(options, 'searchCacheFile') or 'user-data/search-cache.sqlite')
+
+    def open(self, fileName):
+        helpers.makeDirectory(os.path.dirname(fileName) or '.')
+
+        self.connection = sqlite3.connect(fileName, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        self.connection.execute('create table if not exists search ( key text, query text, urls text, expires real, primary key(key) )')
+        self.connection.execute('delete from search where expires < ?', (time.time(),))
+        self.connection.commit()
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+        self.enabled = False
+
+    def __init__(self):
+        self.enabled = False
+        self.connection = None
+        self.lock = threading.Lock()
+        self.log = logging.getLogger()
+        self.hours = 168
+        self.noResultsHours = 24
+        self.hits = 0
+        self.misses = 0
+        self.noResultsHits = 0
+
+# shared by all Google objects
+searchCache = SearchCache()
+
+class CompanyCache:
+    # keeps the details read from each company's page, by company number
+    def get(self, companyNumber):
+        if not self.enabled or not companyNumber:
+            return None
+
+        with self.lock:
+            row = self.connection.execute('select record, expires from company where number = ?', (companyNumber.upper(),)).fetchone()
+
+            if not row or row['expires'] < time.time():
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        return json.loads(row['record'])
+
+    def put(self, companyNumber, record):
+        if not self.enabled or not companyNumber or self.hours <= 0:
+            return
+
+        with self.lock:
+            self.connection.execute('insert or replace into company (number, record, expires) values (?, ?, ?)',
+                (companyNumber.upper(), json.dumps(record), time.time() + self.hours * 3600))
+
+            self.connection.commit()
+
+    def getStatistics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def configure(self, options):
+        self.enabled = bool(get(options, 'companyCache'))
+
+        if not self.enabled:
+            return
+
+        self.hours = float(get(options, 'companyCacheHours') or 0)
+
+        self.open(get(options, 'companyCacheFile') or 'user-data/company-cache.sqlite')
+
+    def open(self, fileName):
+        helpers.makeDirectory(os.path.dirname(fileName) or '.')
+
+        self.connection = sqlite3.connect(fileName, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        self.connection.execute('create table if not exists company ( number text, record text, expires real, primary key(number) )')
+        self.connection.execute('delete from company where expires < ?', (time.time(),))
+        self.connection.commit()
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+        self.enabled = False
+
+    def __init__(self):
+        self.enabled = False
+        self.connection = None
+        self.lock = threading.Lock()
+        self.log = logging.getLogger()
+        self.hours = 720
+        self.hits = 0
+        self.misses = 0
+
+# shared by all NameFinder objects
+companyCache = CompanyCache()
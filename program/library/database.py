@@ -4,6 +4,12 @@ import sqlite3
 import logging
 import time
 import random
+import threading
+import asyncio
+import functools
+import concurrent.futures
+
+from collections import OrderedDict
 
 from . import helpers
 
@@ -11,69 +17,111 @@ from .helpers import get
 
 class Database:
     def execute(self, statement, returnResult=False):
-        self.executeWithRetries(statement)
+        with self.lock:
+            self.executeWithRetries(statement)
 
-        if not returnResult:
-            return
+            if not returnResult:
+                return
         
-        try:
-            rows = self.cursor.fetchall()
+            try:
+                rows = self.cursor.fetchall()
 
-            result = []
+                result = []
         
-            for row in rows:
-                result.append(dict(row))
+                for row in rows:
+                    result.append(dict(row))
 
-            return result
-        except Exception as e:
-            self.handleException(e)
+                return result
+            except Exception as e:
+                self.handleException(e)
 
-    def get(self, table, columns, where, orderBy, orderType, limit=None):
-        result = []
+    # where can use ? for each value in parameters
+    def get(self, table, columns, where, orderBy, orderType, limit=None, parameters=None):
+        with self.lock:
+            result = []
 
-        wherePart = ''
-        orderByPart = ''
-        limitPart = ''
+            wherePart = ''
+            orderByPart = ''
+            limitPart = ''
 
-        if where:
-            wherePart = f' where {where}'
+            if where:
+                wherePart = f' where {where}'
 
-        if orderBy:
-            orderByPart = f' order by {orderBy} {orderType}'
+            if orderBy:
+                orderByPart = f' order by {orderBy} {orderType}'
 
-        if limit:
-            limitPart = f' limit {limit}'
+            if limit:
+                limitPart = f' limit {limit}'
 
-        query = f'select {columns} from {table}{wherePart}{orderByPart}{limitPart};'
+            query = f'select {columns} from {table}{wherePart}{orderByPart}{limitPart};'
 
-        self.executeWithRetries(query)
+            # so reads include rows that haven't been written yet
+            self.flush()
+
+            self.executeWithRetries(query, True, parameters)
+
+            try:
+                rows = self.cursor.fetchall()
+
+                for row in rows:
+                    result.append(dict(row))
+            except Exception as e:
+                self.handleException(e)
+
+            return result
+
+    # yields rows without loading the whole table into memory
+    def getAll(self, table, columns, batchSize=10000):
+        cursor = None
+
+        self.flush()
 
         try:
-            rows = self.cursor.fetchall()
+            if self.type == 'mysql':
+                cursor = self.connection.cursor(dictionary=True)
+            else:
+                cursor = self.connection.cursor()
 
-            for row in rows:
-                result.append(dict(row))
+            cursor.execute(f'select {columns} from {table};')
+
+            while True:
+                rows = cursor.fetchmany(batchSize)
+
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield dict(row)
         except Exception as e:
             self.handleException(e)
+        finally:
+            if cursor:
+                cursor.close()
 
-        return result
-
-    def getFirst(self, table, columns, where, orderBy=None, orderType=None):
+    def getFirst(self, table, columns, where, orderBy=None, orderType=None, parameters=None):
         result = {}
 
-        rows = self.get(table, columns, where, orderBy, orderType, 1)
+        rows = self.get(table, columns, where, orderBy, orderType, 1, parameters)
 
         if len(rows) > 0:
             result = rows[0]
 
         return result
 
-    def executeWithRetries(self, query):
+    def executeWithRetries(self, query, commit=True, parameters=None, many=False):
         maximumTries = 1000
 
+        if self.type == 'mysql':
+            query = query.replace('?', '%s')
+
         for i in range(0, maximumTries):
             try:
-                self.cursor.execute(query)
+                if many:
+                    self.cursor.executemany(query, parameters)
+                elif parameters:
+                    self.cursor.execute(query, parameters)
+                else:
+                    self.cursor.execute(query)
 
                 # if it's here it means it succeeded
                 break
@@ -87,59 +135,141 @@ class Database:
                     self.handleException(e)
                     break
 
-        self.connection.commit()
+        if commit:
+            self.connection.commit()
 
     def insert(self, table, toInsert):
-        if not toInsert:
-            return
+        with self.lock:
+            if not toInsert:
+                return
 
-        items = []
-        
-        if isinstance(toInsert, list):
-            items = toInsert
-            toInsert = None
+            if self.batchSize <= 1:
+                self.runBeforeCommit()
+
+                if isinstance(toInsert, list):
+                    self.insertMany(table, toInsert)
+                else:
+                    self.insertMany(table, [toInsert])
+
+                return
 
-            logging.debug(f'Inserting into {len(items)} into {table}')
-        else:
-            logging.debug(f'Inserting into {table}: {toInsert}')
-            items.append(toInsert)
+            # write behind. flush() writes them in one transaction.
+            if isinstance(toInsert, list):
+                for item in toInsert:
+                    self.pending.append((table, item))
+            else:
+                self.pending.append((table, toInsert))
 
-        columns = []
+            if not self.pendingSince:
+                self.pendingSince = time.monotonic()
 
-        for key in items[0]:
-            columns.append(key)
+            self.flushIfDue()
+
+    def flushIfDue(self):
+        with self.lock:
+            if not self.pending:
+                return
+
+            if len(self.pending) >= self.batchSize or time.monotonic() - self.pendingSince >= self.batchSeconds:
+                self.flush()
+
+    # so rows are written every batchSeconds even when no more inserts come
+    def flushPeriodically(self):
+        while not self.closed.wait(min(self.batchSeconds, 1)):
+            try:
+                self.flushIfDue()
+            except Exception as e:
+                self.handleException(e)
 
-        columns = ', '.join(columns)
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
 
-        groupsOfValues = []
+            started = time.monotonic()
+
+            self.runBeforeCommit()
+
+            pending = self.pending
+
+            self.pending = []
+            self.pendingSince = None
+
+            # one statement per table and set of columns
+            groups = OrderedDict()
+
+            for table, item in pending:
+                key = (table, tuple(item.keys()))
+
+                if not key in groups:
+                    groups[key] = []
+
+                groups[key].append(item)
+
+            for key, items in groups.items():
+                self.insertMany(key[0], items, False)
+
+            self.connection.commit()
+
+            elapsed = time.monotonic() - started
+
+            self.statistics['transactions'] += 1
+            self.statistics['rows'] += len(pending)
+            self.statistics['flushSeconds'] += elapsed
+            self.statistics['maximumFlushSeconds'] = max(self.statistics['maximumFlushSeconds'], elapsed)
+
+            logging.debug(f'Wrote {len(pending)} rows in {elapsed:.3f} seconds')
+
+    # for example so the output files are never behind the database
+    def runBeforeCommit(self):
+        if self.beforeCommit:
+            self.beforeCommit()
+
+    def getStatistics(self):
+        result = dict(self.statistics)
+
+        result['rowsPerTransaction'] = 0
+        result['averageFlushSeconds'] = 0
+
+        if self.statistics['transactions']:
+            result['rowsPerTransaction'] = self.statistics['rows'] / self.statistics['transactions']
+            result['averageFlushSeconds'] = self.statistics['flushSeconds'] / self.statistics['transactions']
+
+        return result
+
+    # rows must all have the same columns
+    def insertMany(self, table, rows, commit=True):
+        with self.lock:
+            if not rows:
+                return
+
+            logging.debug(f'Inserting {len(rows)} rows into {table}')
+
+            columns = list(rows[0].keys())
 
-        for item in items:            
             values = []
-            
-            for key, value in item.items():
-                # escape single quotes
-                if isinstance(value, str):
-                    value = "'" + value.replace("'", "''") + "'"
-                elif value == None:
-                    value = 'null'
 
-                values.append(str(value))
+            for row in rows:
+                values.append(tuple(self.getValue(row.get(column)) for column in columns))
 
-            values = ', '.join(values)
-            values = f'({values})'
+            columnsString = ', '.join(columns)
+            placeholders = ', '.join(['?'] * len(columns))
 
-            groupsOfValues.append(values)
+            query = ''
 
-        groupsOfValues = ', '.join(groupsOfValues)
+            # same text each time so the prepared statement gets reused
+            if self.type == 'sqlite':
+                query = f'insert or replace into {table} ({columnsString}) values ({placeholders});'
+            elif self.type == 'mysql':
+                query = f'replace into {table} ({columnsString}) values ({placeholders});'
 
-        query = ''
+            self.executeWithRetries(query, commit, values, True)
 
-        if self.type == 'sqlite':
-            query = f'insert or replace into {table} ({columns}) values {groupsOfValues};'
-        elif self.type == 'mysql':
-            query = f'replace into {table} ({columns}) values {groupsOfValues};'
+    def getValue(self, value):
+        if value == None or isinstance(value, (str, int, float, bytes)):
+            return value
 
-        self.executeWithRetries(query)
+        return str(value)
 
     def makeTables(self, fileName):
         tables = helpers.getJsonFile(fileName)
@@ -171,10 +301,15 @@ class Database:
 
         try:
             if self.type == 'sqlite':
-                self.connection = sqlite3.connect(name)
+                # the asyncio engine uses it from its database thread
+                self.connection = sqlite3.connect(name, check_same_thread=False)
                 # to get column names
                 self.connection.row_factory = sqlite3.Row
                 self.cursor = self.connection.cursor()
+
+                # readers don't block the writer and commits don't need to wait for every fsync
+                self.cursor.execute(f'pragma journal_mode = {self.journalMode};')
+                self.cursor.execute(f'pragma synchronous = {self.synchronous};')
             elif self.type == 'mysql':
                 import mysql.connector                
                 
@@ -192,19 +327,59 @@ class Database:
         helpers.handleException(e, 'Database error')
 
     def close(self):
-        if self.connection:
-            self.connection.commit()
-            self.cursor.close()
-            self.connection.close()
+        self.closed.set()
 
-    def __init__(self, name=None, type='sqlite'):
+        with self.lock:
+            if self.connection:
+                self.flush()
+
+                statistics = self.getStatistics()
+
+                if statistics['transactions']:
+                    logging.debug(f'Database: {statistics["rows"]} rows in {statistics["transactions"]} transactions. Average flush: {statistics["averageFlushSeconds"]:.3f} seconds.')
+
+                self.connection.commit()
+                self.cursor.close()
+                self.connection.close()
+
+    def __init__(self, name=None, type='sqlite', options=None):
         self.type = type
         self.connection = None
         self.cursor = None
 
+        # the flush thread uses the same connection
+        self.lock = threading.RLock()
+        self.closed = threading.Event()
+
+        self.batchSize = int(get(options, 'databaseBatchSize') or 1)
+        self.batchSeconds = float(get(options, 'databaseBatchSeconds') or 0)
+        self.journalMode = helpers.lettersOnly(get(options, 'databaseJournalMode') or 'wal')
+        self.synchronous = helpers.lettersOnly(get(options, 'databaseSynchronous') or 'normal')
+        self.pending = []
+        self.pendingSince = None
+        self.beforeCommit = None
+
+        self.statistics = {
+            'transactions': 0,
+            'rows': 0,
+            'flushSeconds': 0,
+            'maximumFlushSeconds': 0
+        }
+
         self.stringKeyType = 'text'
 
         if self.type == 'mysql':
             self.stringKeyType = 'varchar(100)'
         
-        self.open(name)
\ No newline at end of file
+        self.open(name)
+
+        if self.connection and self.batchSize > 1 and self.batchSeconds > 0:
+            threading.Thread(target=self.flushPeriodically, name='database-flush', daemon=True).start()
+
+# the asyncio engine's tasks share one connection. this is the only thread that uses it, so the event loop never waits for it.
+databaseExecutor = concurrent.futures.ThreadPoolExecutor(1, 'database')
+
+async def runInDatabaseThread(function, *arguments):
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(databaseExecutor, functools.partial(function, *arguments))
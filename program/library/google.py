@@ -1,6 +1,12 @@
 import logging
 import sys
 import math
+import time
+import re
+import html
+import copy
+import asyncio
+import concurrent.futures
 
 # pip packages
 import lxml.html as lh
@@ -9,71 +15,339 @@ from . import helpers
 
 from .helpers import get
 from .api import Api
+from .api import AsyncApi
 from .website import Website
 from .other import Internet
+from .rate_limiter import googleLimiter
+from .cache import searchCache
 
 class Google:
-    def search(self, query, numberOfResults=10, acceptAll=True, moreParameters={}):
-        results = []
-
+    def search(self, query, numberOfResults=10, acceptAll=True, moreParameters={}, mode=''):
         self.captcha = False
         
         self.api.urlPrefix = self.defaultSearchUrl
 
+        # gets a proxy from the pool only if a page isn't cached. without the pool, the caller's proxy is kept.
+        if self.internet:
+            self.api.proxies = None
+
+        parameters = self.getParameters(query, moreParameters)
+        pageCount = self.getPageCount(numberOfResults, parameters)
+
+        try:
+            results = self.getSearchPage(query, parameters, numberOfResults, acceptAll, 0, mode)
+
+            if pageCount > 1 and not self.hasEnough(results, numberOfResults):
+                results += self.getOtherPages(query, parameters, numberOfResults - len(results), acceptAll, pageCount, mode)
+        finally:
+            if self.internet:
+                self.internet.releaseProxy(self.api.proxies)
+
+        return results
+
+    async def searchAsync(self, query, numberOfResults=10, acceptAll=True, moreParameters={}, mode=''):
+        self.captcha = False
+        
+        self.asyncApi.urlPrefix = self.defaultSearchUrl
+
+        if self.internet:
+            self.asyncApi.proxies = None
+
+        parameters = self.getParameters(query, moreParameters)
+        pageCount = self.getPageCount(numberOfResults, parameters)
+
+        try:
+            results = await self.getSearchPageAsync(query, parameters, numberOfResults, acceptAll, 0, mode)
+
+            if pageCount > 1 and not self.hasEnough(results, numberOfResults):
+                results += await self.getOtherPagesAsync(query, parameters, numberOfResults - len(results), acceptAll, pageCount, mode)
+        finally:
+            if self.internet:
+                self.internet.releaseProxy(self.asyncApi.proxies)
+
+        return results
+
+    # gets the pages after the first at the same time. stops once there are enough results.
+    def getOtherPages(self, query, parameters, needed, acceptAll, pageCount, mode):
+        results = []
+
+        executor = concurrent.futures.ThreadPoolExecutor(self.pageConcurrency, 'google-page')
+
+        try:
+            futures = []
+
+            for pageIndex in range(1, pageCount):
+                futures.append(executor.submit(self.getOtherPage, query, dict(parameters), needed, acceptAll, pageIndex, mode))
+
+            # in page order, so the results stay in the order google ranked them
+            for future in futures:
+                pageResults = future.result()
+
+                if self.captcha or pageResults == ['no results']:
+                    break
+
+                results += pageResults
+
+                if len(results) >= needed:
+                    break
+        finally:
+            executor.shutdown(True, cancel_futures=True)
+
+        return results[0:needed]
+
+    def getOtherPage(self, query, parameters, numberOfResults, acceptAll, pageIndex, mode):
+        api = copy.copy(self.api)
+
+        # each page reserves its own proxy, so no proxy has more requests at once than proxyMaximumConcurrent
         if self.internet:
-            self.api.proxies = self.internet.getRandomProxy()
+            api.proxies = None
+
+        try:
+            return self.getSearchPage(query, parameters, numberOfResults, acceptAll, pageIndex, mode, api)
+        finally:
+            if self.internet:
+                self.internet.releaseProxy(api.proxies)
+
+    async def getOtherPagesAsync(self, query, parameters, needed, acceptAll, pageCount, mode):
+        results = []
+
+        semaphore = asyncio.Semaphore(self.pageConcurrency)
+
+        tasks = []
+
+        for pageIndex in range(1, pageCount):
+            tasks.append(asyncio.create_task(self.getOtherPageAsync(semaphore, query, dict(parameters), needed, acceptAll, pageIndex, mode)))
+
+        try:
+            for task in tasks:
+                pageResults = await task
+
+                if self.captcha or pageResults == ['no results']:
+                    break
+
+                results += pageResults
+
+                if len(results) >= needed:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return results[0:needed]
+
+    async def getOtherPageAsync(self, semaphore, query, parameters, numberOfResults, acceptAll, pageIndex, mode):
+        async with semaphore:
+            api = copy.copy(self.asyncApi)
+
+            if self.internet:
+                api.proxies = None
+
+            try:
+                return await self.getSearchPageAsync(query, parameters, numberOfResults, acceptAll, pageIndex, mode, api)
+            finally:
+                if self.internet:
+                    self.internet.releaseProxy(api.proxies)
+
+    def hasEnough(self, results, numberOfResults):
+        if self.captcha or not isinstance(results, list) or results == ['no results']:
+            return True
+
+        return len(results) >= numberOfResults
+
+    # counts results up to maximum without building the whole list. maximum must be at least 2.
+    def countResults(self, query, maximum=2):
+        results = self.search(query, maximum, True, self.getCountParameters(maximum), 'count')
+
+        return self.getCount(results)
+
+    async def countResultsAsync(self, query, maximum=2):
+        results = await self.searchAsync(query, maximum, True, self.getCountParameters(maximum), 'count')
+
+        return self.getCount(results)
+
+    def getCountParameters(self, maximum):
+        # a smaller page is quicker to download and search
+        return {
+            'num': maximum
+        }
+
+    def getCount(self, results):
+        if results == ['no results']:
+            return 0
+
+        return len(results)
 
+    # returns dictionaries with the url, the link text and the text of the whole result, such as the snippet
+    def searchWithText(self, query, numberOfResults=10, acceptAll=True):
+        return self.search(query, numberOfResults, acceptAll, {}, 'text')
+
+    async def searchWithTextAsync(self, query, numberOfResults=10, acceptAll=True):
+        return await self.searchAsync(query, numberOfResults, acceptAll, {}, 'text')
+
+    def getParameters(self, query, moreParameters):
         parameters = {
             'q': query,
             'hl': 'en'
         }
 
-        parameters = helpers.mergeDictionaries(parameters, moreParameters)
+        return helpers.mergeDictionaries(parameters, moreParameters)
 
-        self.resultsPerPage = 10
-        pages = numberOfResults / self.resultsPerPage
-        pages = math.ceil(pages)
+    def getPageCount(self, numberOfResults, parameters):
+        # one bigger page instead of several, if the search engine allows it
+        if numberOfResults > 10 and self.resultsPerPage > 10 and not 'num' in parameters:
+            parameters['num'] = min(numberOfResults, self.resultsPerPage)
 
-        for pageIndex in range(0, pages):
-            pageResults = self.getSearchPage(query, parameters, numberOfResults, acceptAll, pageIndex)
+        pages = numberOfResults / self.getPageSize(parameters)
 
-            if pageResults and numberOfResults == 1:
-                return pageResults
+        return math.ceil(pages)
 
-            results += (pageResults)
+    def getPageSize(self, parameters):
+        return int(parameters.get('num', 10))
 
-        return results
+    def getSearchPage(self, query, parameters, numberOfResults, acceptAll, pageIndex, mode='', api=None):
+        if not api:
+            api = self.api
+
+        if pageIndex > 0:
+            parameters['start'] = pageIndex * self.getPageSize(parameters)
+
+        found, urlLists = searchCache.get(parameters, mode)
+
+        if found:
+            return self.getResultsFromUrls(urlLists, numberOfResults, acceptAll)
+
+        if self.internet and not api.proxies:
+            api.proxies = self.internet.acquireProxy()
+
+            if self.noProxyIsFree(api):
+                return self.getEmptyResult(numberOfResults)
+
+        key = self.getLimiterKey(api.proxies)
+
+        googleLimiter.acquire(key)
+
+        started = time.monotonic()
+
+        response = api.get('/search', parameters, False, True, cache=True)
+
+        return self.getSearchPageResults(response, query, parameters, numberOfResults, acceptAll, api.proxies, time.monotonic() - started, mode)
+
+    async def getSearchPageAsync(self, query, parameters, numberOfResults, acceptAll, pageIndex, mode='', api=None):
+        if not api:
+            api = self.asyncApi
 
-    def getSearchPage(self, query, parameters, numberOfResults, acceptAll, pageIndex):
         if pageIndex > 0:
-            parameters['start'] = pageIndex * self.resultsPerPage
+            parameters['start'] = pageIndex * self.getPageSize(parameters)
+
+        found, urlLists = await asyncio.to_thread(searchCache.get, parameters, mode)
+
+        if found:
+            return self.getResultsFromUrls(urlLists, numberOfResults, acceptAll)
+
+        if self.internet and not api.proxies:
+            api.proxies = await self.internet.acquireProxyAsync()
+
+            if self.noProxyIsFree(api):
+                return self.getEmptyResult(numberOfResults)
+
+        key = self.getLimiterKey(api.proxies)
 
-        page = self.api.get('/search', parameters, False)
+        await googleLimiter.acquireAsync(key)
+
+        started = time.monotonic()
+
+        response = await api.get('/search', parameters, False, True, cache=True)
+
+        # parses the page and writes the search cache
+        return await asyncio.to_thread(self.getSearchPageResults, response, query, parameters, numberOfResults, acceptAll, api.proxies, time.monotonic() - started, mode)
+
+    # every proxy is resting, usually because of captchas. searching from this computer's own ip address would get it blocked too.
+    # it counts as a captcha, so the line is tried again later.
+    def noProxyIsFree(self, api):
+        if api.proxies or not self.internet.proxies:
+            return False
+
+        self.captcha = True
+
+        return True
+
+    def getEmptyResult(self, numberOfResults):
+        if numberOfResults > 1:
+            return []
+
+        return ''
+
+    def getSearchPageResults(self, response, query, parameters, numberOfResults, acceptAll, proxies, seconds, mode=''):
+        page = ''
+        outcome = 'error'
+        cacheParameters = None
+
+        # failed requests return an empty string
+        if hasattr(response, 'status_code'):
+            page = response.text
+
+            if response.status_code != 429 and response.status_code < 500:
+                outcome = 'ok'
+
+            # error pages aren't worth keeping
+            if response.status_code == 200:
+                cacheParameters = parameters
+
+        # from this page only. other pages of the same search might be using other proxies.
+        if self.isCaptcha(page):
+            outcome = 'captcha'
 
         if '--debug' in sys.argv:
             helpers.toFile(page, 'user-data/logs/page.html')
 
-        return self.getSearchResults(page, query, numberOfResults, acceptAll)
+        try:
+            return self.getSearchResults(page, query, numberOfResults, acceptAll, cacheParameters, mode)
+        finally:
+            googleLimiter.finish(self.getLimiterKey(proxies), outcome)
 
-    def getSearchResults(self, page, query, numberOfResults, acceptAll):
-        result = ''
+            if self.internet:
+                self.internet.recordProxy(proxies, outcome, seconds)
 
-        if numberOfResults > 1:
-            result = []
+    def isCaptcha(self, page):
+        return 'detected unusual traffic from your computer network.' in page
+
+    def getLimiterKey(self, proxies):
+        if not proxies:
+            return ''
+
+        return proxies.get('https', '')
+
+    def getSearchResults(self, page, query, numberOfResults, acceptAll, cacheParameters=None, mode=''):
+        result = self.getEmptyResult(numberOfResults)
 
-        if 'detected unusual traffic from your computer network.' in page:
+        if self.isCaptcha(page):
             self.log.error(f'There is a captcha')
             self.captcha = True
             return result
 
+        urlLists = None
+
         if 'google.' in page and 'did not match any ' in page:
             toDisplay = query.replace('+', ' ')
             self.log.debug(f'No search results for {toDisplay}')
+        elif mode == 'count':
+            urlLists = [self.getCountedUrls(page, numberOfResults)]
+        elif mode == 'text':
+            urlLists = [self.getLinksWithText(page)]
+        else:
+            urlLists = self.getUrlLists(page)
 
-            if numberOfResults == 1:
-                return 'no results'
-            else:
-                return ['no results']
+        # a page without links and without google saying there are no results might be a consent or other interstitial page
+        if cacheParameters and (urlLists == None or any(urlLists)):
+            searchCache.put(cacheParameters, urlLists, mode)
+
+        return self.getResultsFromUrls(urlLists, numberOfResults, acceptAll)
+
+    # every link that could be a result, for each xpath. none means google found nothing.
+    def getUrlLists(self, page):
+        result = []
 
         xpaths = [
             ["//a[contains(@class, ' ') and (contains(@href, '/url?')  or contains(@ping, '/url?'))]", 'href'],
@@ -87,6 +361,8 @@ class Google:
 
             attribute = xpath[1]
 
+            urls = []
+
             for element in elements:
                 url = element
 
@@ -95,14 +371,121 @@ class Google:
                 else:
                     url = element.attrib[attribute]
 
+                urls.append(url)
+
+            result.append(urls)
+
+        return result
+
+    # each result link with the text of the biggest element that holds it and no other result
+    def getLinksWithText(self, page):
+        result = []
+
+        document = lh.fromstring(page)
+
+        links = []
+
+        for link in self.website.getXpathInElement(document, "//a[contains(@href, '/url?') or contains(@ping, '/url?')]", False):
+            if not self.shouldAvoid(link.attrib.get('href', ''), True):
+                links.append(link)
+
+        urls = []
+
+        for link in links:
+            url = link.attrib.get('href', '')
+
+            if url in urls:
+                continue
+
+            urls.append(url)
+
+            block = link
+
+            while block.getparent() is not None:
+                parent = block.getparent()
+
+                otherResult = False
+
+                for element in parent.iter('a'):
+                    if element in links and element.attrib.get('href', '') != url:
+                        otherResult = True
+                        break
+
+                if otherResult:
+                    break
+
+                block = parent
+
+            result.append({
+                'url': url,
+                'title': ' '.join(link.text_content().split()),
+                'text': ' '.join(block.text_content().split())
+            })
+
+        return result
+
+    # looks through the html for links that the xpaths in getUrlLists would find and stops after enough of them.
+    # a link that matches both xpaths counts twice, like it does in a full search.
+    def getCountedUrls(self, page, maximum):
+        result = []
+
+        for match in self.linkRegex.finditer(page):
+            attributes = {}
+
+            for attribute in self.attributeRegex.finditer(match.group(1)):
+                value = attribute.group(2)
+
+                if value[:1] in ['"', "'"]:
+                    value = value[1:-1]
+
+                attributes[attribute.group(1).lower()] = html.unescape(value)
+
+            if not '/url?' in attributes.get('href', '') and not '/url?' in attributes.get('ping', ''):
+                continue
+
+            url = attributes.get('href', '')
+
+            if self.shouldAvoid(url, True):
+                continue
+
+            result.append(url)
+
+            if ' ' in attributes.get('class', ''):
+                result.append(url)
+
+            if len(result) >= maximum:
+                break
+
+        return result[0:maximum]
+
+    def getResultsFromUrls(self, urlLists, numberOfResults, acceptAll):
+        result = ''
+
+        if numberOfResults > 1:
+            result = []
+
+        if urlLists == None:
+            if numberOfResults == 1:
+                return 'no results'
+            else:
+                return ['no results']
+
+        for urls in urlLists:
+            for item in urls:
+                url = item
+
+                # from searchWithText
+                if isinstance(item, dict):
+                    url = get(item, 'url')
+
                 if self.shouldAvoid(url, acceptAll):
                     continue
 
                 if numberOfResults == 1:
-                    result = url
+                    result = item
                     break
                 else:
-                    result.append(url)
+                    result.append(item)
 
                     if len(result) >= numberOfResults:
                         break
@@ -169,8 +552,17 @@ class Google:
 
         self.api.setHeadersFromHarFile('program/resources/headers.txt', '')
 
+        self.asyncApi = AsyncApi('', options)
+        self.asyncApi.headers = self.api.headers
+
         self.defaultSearchUrl = 'https://www.google.com'
 
+        self.resultsPerPage = int(get(options, 'googleResultsPerPage') or 10)
+        self.pageConcurrency = int(get(options, 'googlePageConcurrency') or 2)
+
+        self.linkRegex = re.compile(r'<a\s((?:"[^"]*"|\'[^\']*\'|[^\'">])*)>', re.IGNORECASE)
+        self.attributeRegex = re.compile(r'([\w:-]+)\s*=\s*("[^"]*"|\'[^\']*\'|[^\s>]+)')
+
         if get(options, 'defaultSearchUrl'):
             self.defaultSearchUrl = get(options, 'defaultSearchUrl')
 
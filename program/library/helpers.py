@@ -307,6 +307,54 @@ def getCsvFile(fileName, asDictionary=True, delimiter=','):
     return result
 
 
+# yields one row at a time. can be gzip compressed.
+def readCsvFile(fileName, delimiter=','):
+    import csv
+    import gzip
+
+    if not os.path.isfile(fileName):
+        return
+
+    with open(fileName, 'rb') as file:
+        start = file.read(4)
+
+    if start[0:2] == b'\x1f\x8b':
+        file = gzip.open(fileName, 'rb')
+    elif start == b'PK\x03\x04':
+        file = openFirstCsvInZip(fileName)
+    else:
+        file = open(fileName, 'rb')
+
+    with file:
+        for row in csv.DictReader(decodeLines(file), delimiter=delimiter):
+            if len(row) == 0:
+                continue
+
+            yield row
+
+
+def openFirstCsvInZip(fileName):
+    import zipfile
+
+    # the file stays open until the stream it returns is closed
+    with zipfile.ZipFile(fileName) as archive:
+        names = archive.namelist()
+
+        for name in names:
+            if name.lower().endswith('.csv'):
+                return archive.open(name)
+
+        return archive.open(names[0])
+
+
+def decodeLines(file):
+    for line in file:
+        try:
+            yield line.decode('utf8')
+        except UnicodeDecodeError:
+            yield line.decode('latin-1')
+
+
 def appendCsvFile(row, fileName):
     import csv
 
@@ -5,6 +5,9 @@ import json
 import random
 import re
 import datetime
+import time
+import asyncio
+import threading
 
 from collections import OrderedDict
 
@@ -538,7 +541,7 @@ class ContactHelpers:
         startOfDay = now.replace(hour=0, minute=0, second=0, microsecond=0)
         startOfDay = startOfDay - datetime.timedelta(hours=timezone)
 
-        newResultsToday = database.getFirst('result', 'count(*)', f"site = '{get(inputRow, 'site')}' and mode = '{get(inputRow, 'mode')}' and keyword = '{get(inputRow, 'keyword')}' and destinations != '' and gmDate >= '{startOfDay}'")
+        newResultsToday = database.getFirst('result', 'count(*)', "site = ? and mode = ? and keyword = ? and destinations != '' and gmDate >= ?", parameters=(get(inputRow, 'site'), get(inputRow, 'mode'), get(inputRow, 'keyword'), str(startOfDay)))
         newResultsToday = get(newResultsToday, 'count(*)')
 
         return int(newResultsToday)      
@@ -652,15 +655,10 @@ class Internet:
 
                 result.append(newItem)
 
-        ipInfoApi = Api('', self.options)
-
-        currentIp = ipInfoApi.get('https://ipinfo.io/json')
+        currentIp = self.getCurrentIp()
 
-        if not currentIp or not currentIp.get('ip', ''):
-            self.log.debug('Can\'t find current ip address')
+        if not currentIp:
             return result
-
-        currentIp = currentIp.get('ip', '')
         
         # check if it's already allowed
         if not currentIp in allowedIps and not '--debug' in sys.argv:
@@ -695,6 +693,19 @@ class Internet:
 
         return result
 
+    def getCurrentIp(self):
+        ipInfoApi = Api('', self.options)
+
+        response = ipInfoApi.get('https://ipinfo.io/json')
+
+        if not response or not response.get('ip', ''):
+            self.log.debug('Can\'t find current ip address')
+            return ''
+
+        self.currentIp = response.get('ip', '')
+
+        return self.currentIp
+
     def getProxiesFromMyPrivateProxyApi(self):
         result = None
 
@@ -715,16 +726,11 @@ class Internet:
         if not allowedIps:
             return result
 
-        ipInfoApi = Api('', self.options)
-
-        currentIp = ipInfoApi.get('https://ipinfo.io/json')
+        currentIp = self.getCurrentIp()
 
-        if not currentIp or not currentIp.get('ip', ''):
-            self.log.debug('Can\'t find current ip address')
+        if not currentIp:
             return result
 
-        currentIp = currentIp.get('ip', '')
-
         # check if it's already allowed
         if not currentIp in allowedIps and not '--debug' in sys.argv:
             toKeep = 3
@@ -777,20 +783,87 @@ class Internet:
         return result
 
     def getRandomProxy(self):
-        if not self.proxies:
-            if os.path.exists('user-data/proxies.csv'):
-                self.proxies = helpers.getCsvFile('user-data/proxies.csv')
-            elif self.proxyListUrl:            
-                self.proxies = self.getProxiesFromApi()
+        if not self.loadProxies():
+            return None
 
-            if not self.proxies:
-                self.log.info('No proxies found')
+        proxy = proxyPool.choose(False)
+
+        if not proxy:
+            return None
+
+        return self.getProxiesDictionary(proxy)
 
-        if not self.proxies:
+    # reserves the proxy until releaseProxy is called. gives up if none is free for long enough.
+    def acquireProxy(self):
+        if not self.loadProxies():
             return None
 
-        item = random.choice(self.proxies)
+        started = time.monotonic()
+
+        while True:
+            proxy = proxyPool.choose(True)
+
+            if proxy:
+                return self.getProxiesDictionary(proxy)
+
+            if not proxyPool.shouldWait(started):
+                return None
+
+            proxyPool.stopping.wait(0.5)
+
+    async def acquireProxyAsync(self):
+        # can read files or refresh the proxy list
+        if not await asyncio.to_thread(self.loadProxies):
+            return None
+
+        started = time.monotonic()
+
+        while True:
+            proxy = proxyPool.choose(True)
+
+            if proxy:
+                return self.getProxiesDictionary(proxy)
 
+            if not proxyPool.shouldWait(started):
+                return None
+
+            await asyncio.sleep(0.5)
+
+    def releaseProxy(self, proxies):
+        if proxies:
+            proxyPool.release(proxies.get('http', ''))
+
+    # outcome is ok, captcha or error
+    def recordProxy(self, proxies, outcome, seconds):
+        if proxies:
+            proxyPool.record(proxies.get('http', ''), outcome, seconds)
+
+    def loadProxies(self):
+        proxies = self.proxies
+
+        if os.path.exists('user-data/proxies.csv'):
+            if not proxies:
+                proxies = helpers.getCsvFile('user-data/proxies.csv')
+        elif self.proxyListUrl:
+            # cheap unless the saved list needs to be refreshed
+            proxies = proxyListCache.get(self)
+
+        if not proxies:
+            if not self.noProxiesLogged:
+                self.log.info('No proxies found')
+                self.noProxiesLogged = True
+
+            return False
+
+        # new or refreshed list
+        if proxies is not self.proxies:
+            self.proxies = proxies
+
+            proxyPool.update([self.getProxyUrl(item) for item in proxies])
+
+        return True
+
+    def getProxyUrl(self, item):
         url = item.get('url', '')
         port = item.get('port', '')
         userName = item.get('username', '')
@@ -801,12 +874,15 @@ class Internet:
         if not userName or not password:
             proxy = f'http://{url}:{port}'
 
+        return proxy
+
+    def getProxiesDictionary(self, proxy):
         proxies = {
             'http': proxy,
             'https': proxy
         }
 
-        self.log.debug(f'Using proxy http://{url}:{port}')
+        self.log.debug(f'Using proxy {proxyPool.getName(proxy)}')
 
         return proxies
 
@@ -817,6 +893,359 @@ class Internet:
         self.proxyProvider = 'proxy bonanza'
         self.proxies = None
         self.proxyListUrl = get(self.options, 'proxyListUrl')
+        self.currentIp = ''
+        self.noProxiesLogged = False
+
+class ProxyPool:
+    # prefers fast proxies that rarely fail. proxies that keep failing are rested for a while.
+    def choose(self, reserve):
+        with self.lock:
+            now = time.monotonic()
+
+            candidates = []
+            weights = []
+
+            for proxy, state in self.states.items():
+                if state['quarantinedUntil'] > now:
+                    continue
+
+                if reserve and state['inUse'] >= self.maximumConcurrent:
+                    continue
+
+                candidates.append(proxy)
+                weights.append(self.getWeight(state))
+
+            if not candidates:
+                return None
+
+            # so the next time they're all resting gets logged too
+            self.restingLogged = False
+            self.fallbackLogged = False
+
+            proxy = random.choices(candidates, weights)[0]
+
+            if reserve:
+                self.states[proxy]['inUse'] += 1
+
+            return proxy
+
+    def getWeight(self, state):
+        return max(state['successRate'], 0.01) ** 2 / max(state['seconds'], 0.05)
+
+    # false once the run is stopping or no proxy has been free for proxyMaximumWaitSeconds
+    def shouldWait(self, started):
+        with self.lock:
+            if not self.restingLogged:
+                self.restingLogged = True
+                self.log.info('Every proxy is resting or busy. Waiting for one to be free.')
+
+            if self.stopping.is_set():
+                return False
+
+            if time.monotonic() - started < self.maximumWaitSeconds:
+                return True
+
+            if not self.fallbackLogged:
+                self.fallbackLogged = True
+                self.log.warning(f'No proxy was free for {int(self.maximumWaitSeconds)} seconds. Trying those lines again later.')
+
+        return False
+
+    # stops anything waiting for a proxy
+    def stop(self):
+        self.stopping.set()
+
+    def release(self, proxy):
+        with self.lock:
+            state = self.states.get(proxy)
+
+            if state:
+                state['inUse'] = max(state['inUse'] - 1, 0)
+
+    def record(self, proxy, outcome, seconds):
+        with self.lock:
+            state = self.states.get(proxy)
+
+            if not state:
+                return
+
+            success = 0
+
+            if outcome == 'ok':
+                success = 1
+                state['failuresInARow'] = 0
+                state['seconds'] = self.average(state['seconds'], seconds)
+            else:
+                state[outcome + 's'] += 1
+                state['failuresInARow'] += 1
+
+            state['requests'] += 1
+            state['successRate'] = self.average(state['successRate'], success)
+
+            if outcome == 'captcha' or state['failuresInARow'] >= self.maximumFailuresInARow:
+                # longer each time it happens again
+                seconds = self.quarantineSeconds * 2 ** min(state['quarantines'], 5)
+
+                state['quarantines'] += 1
+                state['quarantinedUntil'] = time.monotonic() + seconds
+                state['failuresInARow'] = 0
+
+                self.log.info(f'Not using proxy {self.getName(proxy)} for {int(seconds)} seconds after {outcome}')
+            elif outcome == 'ok':
+                state['quarantines'] = 0
+
+    # forgets proxies that are no longer in the list
+    def update(self, proxies):
+        proxies = set(proxies)
+
+        for proxy in proxies:
+            self.add(proxy)
+
+        with self.lock:
+            for proxy in list(self.states.keys()):
+                if not proxy in proxies:
+                    del self.states[proxy]
+
+    def average(self, current, new):
+        return current * (1 - self.smoothing) + new * self.smoothing
+
+    def add(self, proxy):
+        with self.lock:
+            if proxy in self.states:
+                return
+
+            self.states[proxy] = {
+                'inUse': 0,
+                'requests': 0,
+                'captchas': 0,
+                'errors': 0,
+                'successRate': 1.0,
+                'seconds': 1.0,
+                'failuresInARow': 0,
+                'quarantines': 0,
+                'quarantinedUntil': 0
+            }
+
+    def getName(self, proxy):
+        # hide the password
+        return helpers.findBetween(proxy, '@', '') or proxy
+
+    def getStatus(self):
+        result = {}
+
+        with self.lock:
+            now = time.monotonic()
+
+            for proxy, state in self.states.items():
+                result[self.getName(proxy)] = {
+                    'requests': state['requests'],
+                    'successRate': round(state['successRate'], 3),
+                    'seconds': round(state['seconds'], 3),
+                    'captchas': state['captchas'],
+                    'errors': state['errors'],
+                    'inUse': state['inUse'],
+                    'quarantinedFor': max(int(state['quarantinedUntil'] - now), 0)
+                }
+
+        return result
+
+    def configure(self, options):
+        self.maximumConcurrent = int(get(options, 'proxyMaximumConcurrent') or 2)
+        self.quarantineSeconds = float(get(options, 'proxyQuarantineSeconds') or 300)
+        self.maximumFailuresInARow = int(get(options, 'proxyMaximumFailuresInARow') or 3)
+        self.maximumWaitSeconds = float(get(options, 'proxyMaximumWaitSeconds') or 60)
+
+    def __init__(self):
+        self.log = logging.getLogger()
+        self.lock = threading.Lock()
+        self.states = {}
+        self.maximumConcurrent = 2
+        self.quarantineSeconds = 300
+        self.maximumFailuresInARow = 3
+        self.maximumWaitSeconds = 60
+        self.stopping = threading.Event()
+        self.restingLogged = False
+        self.fallbackLogged = False
+        self.smoothing = 0.2
+
+# shared by all Internet objects
+proxyPool = ProxyPool()
+
+class ProxyListCache:
+    # keeps the proxy list from the provider in a file, so starting up doesn't need the provider's api.
+    # an old list is still used while a background thread gets a new one. only one process refreshes at a time.
+    def get(self, internet):
+        mustWait = False
+
+        with self.lock:
+            if self.proxies is None:
+                self.load()
+
+            if self.proxies is None:
+                # nothing saved yet, so it has to wait
+                mustWait = self.isStale()
+            elif (self.isStale() or not self.ipChecked) and not self.refreshing:
+                # another process might have refreshed it already
+                self.load()
+
+                if self.isStale() or not self.ipChecked:
+                    self.refreshing = True
+
+                    threading.Thread(target=self.refreshInBackground, args=(internet, self.isStale()), name='proxy-list', daemon=True).start()
+
+        # the provider's api is slow, so other threads keep using the old list meanwhile
+        if mustWait:
+            self.refresh(internet, True)
+
+        return self.proxies
+
+    def refreshInBackground(self, internet, isStale):
+        try:
+            if not isStale:
+                isStale = self.ipChanged(internet)
+
+            if isStale:
+                self.refresh(internet, False)
+        except Exception as e:
+            helpers.handleException(e, 'Could not refresh proxy list', self.log.name)
+        finally:
+            self.refreshing = False
+
+    # the provider only lets in the ip address the list was saved from
+    def ipChanged(self, internet):
+        self.ipChecked = True
+
+        if not self.allowedIp:
+            return False
+
+        currentIp = internet.getCurrentIp()
+
+        if not currentIp or currentIp == self.allowedIp:
+            return False
+
+        self.log.info(f'The ip address changed from {self.allowedIp} to {currentIp}. Getting a new proxy list.')
+
+        return True
+
+    def refresh(self, internet, mustWait):
+        if not self.lockFile():
+            if not mustWait:
+                return
+
+            self.log.info('Waiting for another process to get the proxy list')
+
+            for i in range(0, 120):
+                time.sleep(1)
+
+                if not os.path.exists(self.lockFileName):
+                    break
+
+            self.load()
+            return
+
+        try:
+            self.log.info('Getting proxy list')
+
+            proxies = internet.getProxiesFromApi()
+
+            if proxies:
+                self.save(proxies, internet.currentIp)
+            else:
+                # try again soon, but not on every search
+                self.retryAfter = time.time() + self.retrySeconds
+        finally:
+            self.unlockFile()
+
+    def isStale(self):
+        return time.time() - self.updated > self.hours * 60 * 60 and time.time() >= self.retryAfter
+
+    def load(self):
+        if not os.path.exists(self.fileName):
+            return
+
+        data = helpers.getJsonFile(self.fileName)
+
+        if not get(data, 'proxies'):
+            return
+
+        with self.lock:
+            if data.get('updated', 0) <= self.updated and self.proxies is not None:
+                return
+
+            self.proxies = data['proxies']
+            self.updated = data.get('updated', 0)
+            self.allowedIp = data.get('allowedIp', '')
+
+    def save(self, proxies, allowedIp):
+        data = {
+            'updated': time.time(),
+            'allowedIp': allowedIp,
+            'proxies': proxies
+        }
+
+        helpers.makeDirectory(os.path.dirname(self.fileName) or '.')
+
+        # other processes might be reading it
+        temporaryFileName = f'{self.fileName}.{os.getpid()}.tmp'
+
+        helpers.toFile(json.dumps(data), temporaryFileName)
+        os.replace(temporaryFileName, self.fileName)
+
+        with self.lock:
+            self.proxies = proxies
+            self.updated = data['updated']
+            self.allowedIp = allowedIp
+            self.ipChecked = True
+
+        self.log.info(f'Saved {len(proxies)} proxies to {self.fileName}')
+
+    def lockFile(self):
+        helpers.makeDirectory(os.path.dirname(self.lockFileName) or '.')
+
+        # in case a process stopped without removing it
+        try:
+            if time.time() - os.path.getmtime(self.lockFileName) > 10 * 60:
+                os.remove(self.lockFileName)
+        except OSError:
+            pass
+
+        try:
+            os.close(os.open(self.lockFileName, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def unlockFile(self):
+        try:
+            os.remove(self.lockFileName)
+        except OSError:
+            pass
+
+    def configure(self, options):
+        self.fileName = get(options, 'proxyCacheFile') or 'user-data/proxy-cache.json'
+        self.lockFileName = self.fileName + '.lock'
+        self.hours = float(get(options, 'proxyCacheHours') or 6)
+        self.proxies = None
+        self.updated = 0
+        self.retryAfter = 0
+        self.ipChecked = False
+
+    def __init__(self):
+        self.log = logging.getLogger()
+        self.lock = threading.RLock()
+        self.fileName = 'user-data/proxy-cache.json'
+        self.lockFileName = self.fileName + '.lock'
+        self.hours = 6
+        self.proxies = None
+        self.updated = 0
+        self.allowedIp = ''
+        self.refreshing = False
+        self.retryAfter = 0
+        self.retrySeconds = 5 * 60
+        self.ipChecked = False
+
+# shared by all Internet objects
+proxyListCache = ProxyListCache()
 
 class LocationHelper:
     # a box centered at given coordinates and of a given width
@@ -917,7 +1346,7 @@ class LocationHelper:
     def getCoordinatesForZipCode(self, zipcodeToFind):
         result = ''
         
-        row = self.database.getFirst('zipcode', 'latitude, longitude', f'id = {zipcodeToFind}')
+        row = self.database.getFirst('zipcode', 'latitude, longitude', 'id = ?', parameters=(zipcodeToFind,))
 
         self.log.debug(f'Row: {row}')
         
@@ -934,7 +1363,7 @@ class LocationHelper:
         cityToFind = helpers.findBetween(location, '', ',').strip().lower()
         stateToFind = helpers.findBetween(location, ',', '').strip().lower()
 
-        row = self.database.getFirst('city', 'lat, lng', f"city_ascii = '{cityToFind}' and state_id = '{stateToFind}'")
+        row = self.database.getFirst('city', 'lat, lng', 'city_ascii = ? and state_id = ?', parameters=(cityToFind, stateToFind))
 
         self.log.debug(f'Row: {row}')
         
@@ -0,0 +1,275 @@
+import os
+import io
+import csv
+import json
+import time
+import datetime
+import atexit
+import logging
+import threading
+
+from . import helpers
+
+from .helpers import get
+
+class CsvOutput:
+    # keeps the file open and writes rows in groups. safe to use from several threads.
+    def write(self, item):
+        values = []
+
+        for field in self.fields:
+            values.append(get(item, field))
+
+        with self.lock:
+            if not self.file:
+                self.open()
+
+            self.writer.writerow(values)
+            self.rowsSinceFlush += 1
+            self.rowsSinceSync += 1
+
+            if self.rowsSinceFlush >= self.batchSize or time.monotonic() - self.lastFlush >= self.batchSeconds:
+                self.flushNow()
+
+    def open(self):
+        helpers.makeDirectory(os.path.dirname(self.fileName) or '.')
+
+        isNew = not os.path.exists(self.fileName) or not os.path.getsize(self.fileName)
+
+        self.file = io.open(self.fileName, 'a', newline='\n', encoding='utf-8', buffering=1024 * 1024)
+
+        if isNew:
+            self.file.write(','.join(self.headers) + '\n')
+
+        # this quote fields that contain commas
+        self.writer = csv.writer(self.file, delimiter=',')
+
+    def flush(self):
+        with self.lock:
+            self.flushNow()
+
+    def flushNow(self):
+        if self.file:
+            self.file.flush()
+
+        self.rowsSinceFlush = 0
+        self.lastFlush = time.monotonic()
+
+    # on disk even after a power cut
+    def sync(self):
+        with self.lock:
+            if not self.file or not self.rowsSinceSync:
+                return
+
+            self.flushNow()
+
+            os.fsync(self.file.fileno())
+
+            self.rowsSinceSync = 0
+
+    # so rows are written every batchSeconds even when no more results come
+    def flushPeriodically(self):
+        while not self.closed.wait(min(self.batchSeconds, 1)):
+            try:
+                with self.lock:
+                    if self.rowsSinceFlush and time.monotonic() - self.lastFlush >= self.batchSeconds:
+                        self.flushNow()
+            except Exception as e:
+                helpers.handleException(e, 'Could not write output file', self.log.name)
+
+    def close(self):
+        self.closed.set()
+
+        with self.lock:
+            if not self.file:
+                return
+
+            self.flushNow()
+            self.file.close()
+            self.file = None
+
+    def __init__(self, fileName, fields, headers, options=None):
+        self.fileName = fileName
+        self.fields = fields
+        self.headers = headers
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.batchSize = int(get(options, 'outputBatchSize') or 1)
+        self.batchSeconds = float(get(options, 'outputBatchSeconds') or 0)
+        self.lock = threading.Lock()
+        self.file = None
+        self.writer = None
+        self.rowsSinceFlush = 0
+        self.rowsSinceSync = 0
+        self.lastFlush = time.monotonic()
+        self.closed = threading.Event()
+
+        if self.batchSize > 1 and self.batchSeconds > 0:
+            threading.Thread(target=self.flushPeriodically, name='output-flush', daemon=True).start()
+
+        # in case the run ends without cleaning up
+        atexit.register(self.close)
+
+class JsonLinesOutput(CsvOutput):
+    # one json object per line
+    def write(self, item):
+        newItem = {}
+
+        for field in self.fields:
+            newItem[field] = get(item, field)
+
+        line = json.dumps(newItem)
+
+        with self.lock:
+            if not self.file:
+                self.open()
+
+            self.file.write(line + '\n')
+            self.rowsSinceFlush += 1
+            self.rowsSinceSync += 1
+
+            if self.rowsSinceFlush >= self.batchSize or time.monotonic() - self.lastFlush >= self.batchSeconds:
+                self.flushNow()
+
+    def open(self):
+        helpers.makeDirectory(os.path.dirname(self.fileName) or '.')
+
+        self.file = io.open(self.fileName, 'a', encoding='utf-8', buffering=1024 * 1024)
+
+class ParquetOutput:
+    # writes a row group each time enough rows are waiting, so memory use stays bounded
+    def write(self, item):
+        with self.lock:
+            for field in self.fields:
+                value = get(item, field)
+
+                if field in self.integerFields:
+                    value = int(value or 0)
+                else:
+                    value = str(value)
+
+                self.columns[field].append(value)
+
+            self.rowsWaiting += 1
+
+            if self.rowsWaiting >= self.rowGroupSize:
+                self.flushNow()
+
+    def flush(self):
+        with self.lock:
+            self.flushNow()
+
+    def flushNow(self):
+        if not self.rowsWaiting:
+            return
+
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.Table.from_pydict(self.columns, schema=self.getSchema())
+
+        if not self.writer:
+            helpers.makeDirectory(os.path.dirname(self.fileName) or '.')
+
+            self.writer = pyarrow.parquet.ParquetWriter(self.fileName, table.schema, compression='snappy')
+
+        self.writer.write_table(table)
+
+        self.columns = {field: [] for field in self.fields}
+        self.rowsWaiting = 0
+
+    def getSchema(self):
+        import pyarrow
+
+        columns = []
+
+        for field in self.fields:
+            if field in self.integerFields:
+                columns.append((field, pyarrow.int64()))
+            else:
+                columns.append((field, pyarrow.string()))
+
+        return pyarrow.schema(columns)
+
+    def close(self):
+        with self.lock:
+            try:
+                self.flushNow()
+            except Exception as e:
+                helpers.handleException(e, 'Could not write parquet file', self.log.name)
+
+            if self.writer:
+                self.writer.close()
+                self.writer = None
+
+    def __init__(self, fileName, fields, integerFields, options=None):
+        # a parquet file can't be appended to, so each run gets its own file
+        timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+
+        self.fileName = f'{os.path.splitext(fileName)[0]}-{timestamp}.parquet'
+        self.fields = fields
+        self.integerFields = integerFields
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.rowGroupSize = int(get(options, 'parquetRowGroupSize') or 10000)
+        self.lock = threading.Lock()
+        self.writer = None
+        self.columns = {field: [] for field in self.fields}
+        self.rowsWaiting = 0
+
+        try:
+            import pyarrow
+        except ImportError as e:
+            helpers.handleException(e, 'You should run "pip3 install pyarrow" or "pip install pyarrow" first, then restart this script')
+            raise
+
+        atexit.register(self.close)
+
+class Outputs:
+    # sends each result to every output
+    def write(self, item):
+        for output in self.outputs:
+            output.write(item)
+
+    def flush(self):
+        for output in self.outputs:
+            output.flush()
+
+    # before the database saves the same results, so a rerun never skips a result that isn't in the files.
+    # a parquet file is only complete once it's closed, so it keeps its row groups.
+    def sync(self):
+        for output in self.outputs:
+            if isinstance(output, CsvOutput):
+                output.sync()
+
+    def close(self):
+        for output in self.outputs:
+            output.close()
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+def getOutputs(options, fields, headers, integerFields=[]):
+    outputs = []
+
+    fileName = options['outputFile']
+    base = os.path.splitext(fileName)[0]
+
+    for outputFormat in get(options, 'outputFormats').split(','):
+        outputFormat = outputFormat.strip().lower()
+
+        if outputFormat == 'csv':
+            outputs.append(CsvOutput(fileName, fields, headers, options))
+        elif outputFormat == 'jsonl':
+            outputs.append(JsonLinesOutput(f'{base}.jsonl', fields, headers, options))
+        elif outputFormat == 'parquet':
+            try:
+                outputs.append(ParquetOutput(fileName, fields, integerFields, options))
+            except ImportError:
+                continue
+        elif outputFormat:
+            logging.getLogger(get(options, 'loggerName')).error(f'Unknown output format: {outputFormat}')
+
+    if not outputs:
+        outputs.append(CsvOutput(fileName, fields, headers, options))
+
+    return Outputs(outputs)
+
@@ -0,0 +1,406 @@
+import os
+import time
+import json
+import asyncio
+import fnmatch
+import logging
+import threading
+import urllib.parse
+
+from . import helpers
+
+from .helpers import get
+
+class TokenBucket:
+    # returns how long to wait before the request can be sent
+    def reserve(self):
+        now = time.monotonic()
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        self.tokens -= 1
+
+        if self.tokens >= 0:
+            return 0
+
+        return -self.tokens / self.rate
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+class RateLimiter:
+    def wait(self, url):
+        seconds = self.reserve(url)
+
+        if seconds > 0:
+            time.sleep(seconds)
+
+    async def waitAsync(self, url):
+        seconds = self.reserve(url)
+
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def reserve(self, url):
+        if not self.limits and not self.defaultLimit:
+            return 0
+
+        host = urllib.parse.urlparse(url).netloc.lower()
+
+        with self.lock:
+            bucket = self.buckets.get(host)
+
+            if not bucket:
+                limit = self.getLimit(host)
+
+                if not limit:
+                    self.buckets[host] = False
+                    return 0
+
+                bucket = TokenBucket(limit[0], limit[1])
+                self.buckets[host] = bucket
+
+            if bucket == False:
+                return 0
+
+            seconds = bucket.reserve()
+
+        if seconds > 0:
+            self.log.debug(f'Waiting {seconds:.2f} seconds before requesting {host}')
+
+        return seconds
+
+    # first matching pattern wins
+    def getLimit(self, host):
+        for pattern, limit in self.limits:
+            if fnmatch.fnmatch(host, pattern):
+                return limit
+
+        return self.defaultLimit
+
+    def configure(self, options):
+        self.limits = []
+        self.defaultLimit = None
+        self.buckets = {}
+
+        # for example: *google.*=0.2/2,beta.companieshouse.gov.uk=2/5,default=0
+        for item in str(get(options, 'rateLimits')).split(','):
+            pattern = helpers.findBetween(item, '', '=').strip().lower()
+            value = helpers.findBetween(item, '=', '', True).strip()
+
+            if not pattern or not value:
+                continue
+
+            rate = float(helpers.findBetween(value, '', '/'))
+            burst = float(helpers.findBetween(value, '/', '', True) or 1)
+
+            limit = None
+
+            # 0 means no limit
+            if rate > 0:
+                limit = (rate, max(burst, 1))
+
+            if pattern == 'default':
+                self.defaultLimit = limit
+            else:
+                self.limits.append((pattern, limit))
+
+        # the old option becomes the gap between requests to the same website
+        secondsBetweenLines = float(get(options, 'secondsBetweenLines') or 0)
+
+        if not self.defaultLimit and secondsBetweenLines > 0:
+            self.defaultLimit = (1 / secondsBetweenLines, 1)
+
+    def __init__(self):
+        self.log = logging.getLogger()
+        self.lock = threading.Lock()
+        self.limits = []
+        self.defaultLimit = None
+        self.buckets = {}
+
+class AdaptiveLimiter:
+    # raises the limits slowly while requests succeed and halves them on a captcha or error. tracked per proxy.
+    def acquire(self, key):
+        if not self.enabled:
+            return
+
+        with self.condition:
+            while not self.tryStart(key):
+                self.condition.wait(1)
+
+            seconds = self.states[key]['bucket'].reserve()
+
+        if seconds > 0:
+            time.sleep(seconds)
+
+    async def acquireAsync(self, key):
+        if not self.enabled:
+            return
+
+        while True:
+            with self.condition:
+                if self.tryStart(key):
+                    seconds = self.states[key]['bucket'].reserve()
+                    break
+
+            await asyncio.sleep(0.1)
+
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def tryStart(self, key):
+        state = self.getState(key)
+
+        if state['inFlight'] >= int(state['concurrency']):
+            return False
+
+        state['inFlight'] += 1
+
+        return True
+
+    # outcome is ok, captcha or error
+    def finish(self, key, outcome):
+        if not self.enabled:
+            return
+
+        with self.condition:
+            state = self.getState(key)
+            state['inFlight'] = max(state['inFlight'] - 1, 0)
+
+            bucket = state['bucket']
+
+            if outcome == 'ok':
+                state['successes'] += 1
+
+                # about one more concurrent request per window of successes
+                state['concurrency'] = min(state['concurrency'] + 1 / state['concurrency'], self.maximumConcurrency)
+                bucket.rate = min(bucket.rate + self.rateIncrease, self.maximumRate)
+            else:
+                state[outcome + 's'] += 1
+
+                state['concurrency'] = max(state['concurrency'] * self.decrease, 1)
+                bucket.rate = max(bucket.rate * self.decrease, self.minimumRate)
+
+                # don't send the requests that were already allowed
+                bucket.tokens = min(bucket.tokens, 0)
+
+                self.log.info(f'Google {outcome} through {self.getName(key)}. Limits are now {bucket.rate:.2f} requests per second and {int(state["concurrency"])} at once.')
+
+            self.condition.notify_all()
+
+        self.writeStatusIfDue(outcome != 'ok')
+
+    def getState(self, key):
+        state = self.states.get(key)
+
+        if not state:
+            state = {
+                'bucket': TokenBucket(self.initialRate, 1),
+                'concurrency': float(self.initialConcurrency),
+                'inFlight': 0,
+                'successes': 0,
+                'captchas': 0,
+                'errors': 0
+            }
+
+            self.states[key] = state
+
+        return state
+
+    def getName(self, key):
+        if not key:
+            return 'no proxy'
+
+        # hide the password
+        return helpers.findBetween(key, '@', '') or key
+
+    def getStatus(self):
+        result = {}
+
+        with self.condition:
+            for key, state in self.states.items():
+                result[self.getName(key)] = {
+                    'requestsPerSecond': round(state['bucket'].rate, 3),
+                    'concurrency': int(state['concurrency']),
+                    'inFlight': state['inFlight'],
+                    'successes': state['successes'],
+                    'captchas': state['captchas'],
+                    'errors': state['errors']
+                }
+
+        return result
+
+    # so the current limits can be watched while it runs
+    def writeStatusIfDue(self, force=False):
+        if not self.statusFile:
+            return
+
+        now = time.monotonic()
+
+        if not force and now - self.statusWritten < 30:
+            return
+
+        self.statusWritten = now
+
+        try:
+            helpers.makeDirectory(os.path.dirname(self.statusFile) or '.')
+            helpers.toFile(json.dumps(self.getStatus(), indent=4), self.statusFile)
+        except Exception as e:
+            helpers.handleException(e, 'Could not write limits', self.log.name)
+
+    def configure(self, options):
+        self.enabled = bool(get(options, 'googleAdaptiveLimits'))
+        self.initialRate = float(get(options, 'googleInitialRate') or 0.5)
+        self.minimumRate = float(get(options, 'googleMinimumRate') or 0.05)
+        self.maximumRate = float(get(options, 'googleMaximumRate') or 5)
+        self.rateIncrease = float(get(options, 'googleRateIncrease') or 0.02)
+        self.initialConcurrency = int(get(options, 'googleInitialConcurrency') or 2)
+        self.maximumConcurrency = int(get(options, 'googleMaximumConcurrency') or 20)
+        self.statusFile = get(options, 'googleLimitsFile')
+        self.states = {}
+
+    def __init__(self):
+        self.log = logging.getLogger()
+        self.condition = threading.Condition()
+        self.enabled = False
+        self.initialRate = 0.5
+        self.minimumRate = 0.05
+        self.maximumRate = 5
+        self.rateIncrease = 0.02
+        self.initialConcurrency = 2
+        self.maximumConcurrency = 20
+        self.decrease = 0.5
+        self.statusFile = ''
+        self.statusWritten = 0
+        self.states = {}
+
+class WindowBudget:
+    # some apis allow a number of requests per window for each key. the response headers say how many are left.
+    def acquire(self):
+        if not self.enabled:
+            return
+
+        with self.condition:
+            while True:
+                seconds = self.tryStart()
+
+                if seconds <= 0:
+                    break
+
+                self.condition.wait(min(seconds, 1))
+
+    async def acquireAsync(self):
+        if not self.enabled:
+            return
+
+        while True:
+            with self.condition:
+                seconds = self.tryStart()
+
+            if seconds <= 0:
+                break
+
+            await asyncio.sleep(min(seconds, 1))
+
+    # returns how long to wait before trying again or 0 if the request can be sent
+    def tryStart(self):
+        now = time.time()
+
+        if now >= self.resetAt:
+            self.remaining = self.limit
+            self.resetAt = now + self.windowSeconds
+
+        if self.inFlight >= self.maximumConcurrent:
+            return 0.1
+
+        if self.remaining <= 0:
+            if not self.waitLogged:
+                self.waitLogged = True
+                self.log.info(f'Used all {self.limit} requests for this window. Waiting {int(self.resetAt - now)} seconds.')
+
+            return self.resetAt - now
+
+        self.waitLogged = False
+        self.remaining -= 1
+        self.inFlight += 1
+        self.requests += 1
+
+        return 0
+
+    # response can be none if the request failed
+    def finish(self, response):
+        if not self.enabled:
+            return
+
+        with self.condition:
+            self.inFlight = max(self.inFlight - 1, 0)
+
+            headers = getattr(response, 'headers', None) or {}
+
+            limit = headers.get('X-Ratelimit-Limit')
+            remaining = headers.get('X-Ratelimit-Remain')
+            resetAt = headers.get('X-Ratelimit-Reset')
+
+            if limit:
+                self.limit = int(limit)
+
+            # requests that are still in flight were already counted here
+            if remaining:
+                self.remaining = min(self.remaining, int(remaining))
+
+            if resetAt:
+                self.resetAt = float(resetAt)
+
+            if getattr(response, 'status_code', 0) == 429:
+                self.limited += 1
+                self.remaining = 0
+
+                if not resetAt:
+                    self.resetAt = time.time() + self.windowSeconds
+
+                self.log.info(f'Too many requests. Waiting until the window resets.')
+
+            self.condition.notify_all()
+
+    def getStatistics(self):
+        with self.condition:
+            return {
+                'requests': self.requests,
+                'limited': self.limited,
+                'remaining': self.remaining
+            }
+
+    def configure(self, options, prefix):
+        self.enabled = True
+        self.limit = int(get(options, prefix + 'RequestsPerWindow') or 600)
+        self.windowSeconds = float(get(options, prefix + 'WindowSeconds') or 300)
+        self.maximumConcurrent = int(get(options, prefix + 'Concurrency') or 4)
+        self.remaining = self.limit
+        self.resetAt = 0
+
+    def __init__(self):
+        self.log = logging.getLogger()
+        self.condition = threading.Condition()
+        self.enabled = False
+        self.limit = 600
+        self.windowSeconds = 300
+        self.maximumConcurrent = 4
+        self.remaining = self.limit
+        self.resetAt = 0
+        self.inFlight = 0
+        self.requests = 0
+        self.limited = 0
+        self.waitLogged = False
+
+# shared by all Api objects
+rateLimiter = RateLimiter()
+
+# shared by all Google objects
+googleLimiter = AdaptiveLimiter()
+
+# shared by all CompaniesHouseApi objects
+companiesHouseBudget = WindowBudget()
@@ -0,0 +1,64 @@
+import time
+import heapq
+import logging
+import threading
+
+from . import helpers
+
+from .helpers import get
+
+class RetryQueue:
+    # waits longer after each failed attempt
+    def add(self, item, key):
+        with self.lock:
+            attempts = self.attempts.get(key, 0) + 1
+
+            if attempts > self.maximumAttempts:
+                self.log.error(f'Giving up on {key} after {self.maximumAttempts} attempts. It will be tried again on the next run.')
+                self.attempts.pop(key, None)
+                return False
+
+            self.attempts[key] = attempts
+
+            seconds = min(self.seconds * 2 ** (attempts - 1), self.maximumSeconds)
+
+            self.log.info(f'Will try {key} again in {int(seconds)} seconds. Attempt {attempts} of {self.maximumAttempts}.')
+
+            self.counter += 1
+
+            heapq.heappush(self.items, (time.monotonic() + seconds, self.counter, key, item))
+
+        return True
+
+    def getReady(self):
+        with self.lock:
+            if not self.items or self.items[0][0] > time.monotonic():
+                return None
+
+            return heapq.heappop(self.items)[3]
+
+    def finished(self, key):
+        with self.lock:
+            self.attempts.pop(key, None)
+
+    # none if nothing is waiting
+    def getSecondsUntilReady(self):
+        with self.lock:
+            if not self.items:
+                return None
+
+            return max(self.items[0][0] - time.monotonic(), 0)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def __init__(self, options):
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.seconds = float(get(options, 'captchaRetrySeconds') or 60)
+        self.maximumSeconds = float(get(options, 'captchaMaximumRetrySeconds') or 3600)
+        self.maximumAttempts = int(get(options, 'captchaMaximumAttempts') or 10)
+        self.lock = threading.Lock()
+        self.items = []
+        self.attempts = {}
+        self.counter = 0
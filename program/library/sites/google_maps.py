@@ -107,7 +107,7 @@ class GoogleMaps:
                 nextPageTokenPart = f'&pagetoken={nextPageToken}'
 
             for attempt in range(0, 10):
-                j = self.api.get(f'{url}{nextPageTokenPart}')
+                j = self.api.get(f'{url}{nextPageTokenPart}', cache=True)
 
                 # might need to wait for next page to be ready
                 if j.get('status', '') == 'INVALID_REQUEST':
@@ -195,7 +195,7 @@ class SiteHelpers:
     def inDatabase(inputRow, id, database):
         result = False
         
-        row = database.getFirst('result', 'id', f"site = '{get(inputRow, 'site')}' and id = '{id}' and mode = '{get(inputRow, 'mode')}'")
+        row = database.getFirst('result', 'id', 'site = ? and id = ? and mode = ?', parameters=(get(inputRow, 'site'), id, get(inputRow, 'mode')))
 
         if row:
             logging.debug(f'Skipping. Already have {id} in the database.')
@@ -0,0 +1,221 @@
+import json
+import base64
+import asyncio
+import logging
+
+from ..library import helpers
+
+from ..library.helpers import get
+from ..library.api import Api
+from ..library.api import AsyncApi
+from ..library.cache import companyCache
+from ..library.rate_limiter import companiesHouseBudget
+
+class CompaniesHouseApi:
+    # finds companies through the official companies house api instead of google and the company pages.
+    # needs a free key from https://developer.company-information.service.gov.uk
+    def find(self, domain):
+        query = self.getQuery(domain)
+
+        if not query:
+            return {}
+
+        response = self.getResponse(self.api, '/search/companies', {'q': query, 'items_per_page': self.resultsPerSearch})
+
+        item = self.getBestMatch(domain, self.getJson(response).get('items', []))
+
+        if not item:
+            return {}
+
+        if self.hasDetails(item):
+            return self.getRecordFromSearchItem(item)
+
+        return self.getCompany(get(item, 'company_number'))
+
+    async def findAsync(self, domain):
+        query = self.getQuery(domain)
+
+        if not query:
+            return {}
+
+        response = await self.getResponseAsync(self.asyncApi, '/search/companies', {'q': query, 'items_per_page': self.resultsPerSearch})
+
+        item = self.getBestMatch(domain, self.getJson(response).get('items', []))
+
+        if not item:
+            return {}
+
+        # the company cache is sqlite
+        if self.hasDetails(item):
+            return await asyncio.to_thread(self.getRecordFromSearchItem, item)
+
+        return await self.getCompanyAsync(get(item, 'company_number'))
+
+    def getCompany(self, companyNumber):
+        result = companyCache.get(companyNumber)
+
+        if result != None:
+            return result
+
+        response = self.getResponse(self.api, f'/company/{companyNumber}', None)
+
+        return self.getRecordFromProfile(self.getJson(response))
+
+    async def getCompanyAsync(self, companyNumber):
+        result = await asyncio.to_thread(companyCache.get, companyNumber)
+
+        if result != None:
+            return result
+
+        response = await self.getResponseAsync(self.asyncApi, f'/company/{companyNumber}', None)
+
+        return await asyncio.to_thread(self.getRecordFromProfile, self.getJson(response))
+
+    # tries again after the window resets if there were too many requests
+    def getResponse(self, api, url, parameters):
+        response = None
+
+        for attempt in range(0, self.maximumAttempts):
+            response = api.get(url, parameters, False, True, cache=True)
+
+            if getattr(response, 'status_code', 0) != 429:
+                break
+
+        return response
+
+    async def getResponseAsync(self, api, url, parameters):
+        response = None
+
+        for attempt in range(0, self.maximumAttempts):
+            response = await api.get(url, parameters, False, True, cache=True)
+
+            if getattr(response, 'status_code', 0) != 429:
+                break
+
+        return response
+
+    def getJson(self, response):
+        statusCode = getattr(response, 'status_code', 0)
+
+        if statusCode == 401 and not self.keyErrorLogged:
+            self.keyErrorLogged = True
+            self.log.error('The Companies House API did not accept the key. Check companiesHouseApiKey in options.ini.')
+
+        if statusCode != 200:
+            return {}
+
+        try:
+            return json.loads(response.text)
+        except Exception as e:
+            helpers.handleException(e, 'Could not read the Companies House API response', self.log.name)
+
+        return {}
+
+    def getQuery(self, domain):
+        # separate words are easier to find
+        return self.compare.getBasicDomain(domain).replace('-', ' ')
+
+    def getBestMatch(self, domain, items):
+        bestSimilarity = 0
+        bestItem = None
+
+        for item in items:
+            similarity = self.compare.domainSimilarity(domain, get(item, 'title'), get(item, 'company_status'))
+
+            if similarity > bestSimilarity:
+                bestSimilarity = similarity
+                bestItem = item
+
+        if not bestItem or bestSimilarity < self.minimumSimilarity:
+            self.log.debug(f'No good match for {domain} in the Companies House API')
+            return None
+
+        return bestItem
+
+    # search results usually have everything, so the profile isn't needed
+    def hasDetails(self, item):
+        return get(item, 'company_number') and get(item, 'title') and get(item, 'company_status') and get(item, 'address_snippet')
+
+    # same fields as the company page gives
+    def getRecordFromSearchItem(self, item):
+        result = {
+            'companyName': get(item, 'title'),
+            'companyNumber': get(item, 'company_number'),
+            'registered office address': get(item, 'address_snippet'),
+            'company status': self.getStatus(get(item, 'company_status'))
+        }
+
+        companyCache.put(result['companyNumber'], result)
+
+        return result
+
+    def getRecordFromProfile(self, j):
+        if not get(j, 'company_name'):
+            return {}
+
+        addressFields = [
+            'care_of',
+            'po_box',
+            'premises',
+            'address_line_1',
+            'address_line_2',
+            'locality',
+            'region',
+            'country',
+            'postal_code'
+        ]
+
+        address = []
+
+        for field in addressFields:
+            value = helpers.getNested(j, ['registered_office_address', field])
+
+            if value:
+                address.append(value)
+
+        result = {
+            'companyName': get(j, 'company_name'),
+            'companyNumber': get(j, 'company_number'),
+            'registered office address': ', '.join(address),
+            'company status': self.getStatus(get(j, 'company_status'))
+        }
+
+        companyCache.put(result['companyNumber'], result)
+
+        return result
+
+    # the api says "voluntary-arrangement" where the page says "Voluntary arrangement"
+    def getStatus(self, status):
+        return status.replace('-', ' ').capitalize()
+
+    def getApi(self, apiClass):
+        result = apiClass(self.url, self.options)
+
+        # the key is the user name and the password is empty
+        key = base64.b64encode(f'{self.key}:'.encode('utf-8')).decode('utf-8')
+
+        result.headers = {
+            'accept': 'application/json',
+            'authorization': f'Basic {key}'
+        }
+
+        result.budget = companiesHouseBudget
+
+        return result
+
+    def __init__(self, options, compare):
+        self.options = options
+        self.compare = compare
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.url = get(options, 'companiesHouseApiUrl') or 'https://api.company-information.service.gov.uk'
+        self.key = get(options, 'companiesHouseApiKey')
+        self.minimumSimilarity = float(get(options, 'companiesHouseApiMinimumMatch') or 0.8)
+        self.resultsPerSearch = 20
+        self.maximumAttempts = 3
+        self.keyErrorLogged = False
+
+        if not self.key:
+            self.log.error('You must put your Companies House API key into companiesHouseApiKey in options.ini')
+
+        self.api = self.getApi(Api)
+        self.asyncApi = self.getApi(AsyncApi)
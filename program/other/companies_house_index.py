@@ -0,0 +1,313 @@
+import os
+import time
+import zlib
+import sqlite3
+import logging
+import argparse
+import datetime
+
+from ..library import helpers
+
+from ..library.helpers import get
+
+class CompaniesHouseIndex:
+    # finds companies in a local copy of the companies house register, so most domains don't need google or the
+    # companies house website. the copy comes from the free "basic company data" file.
+    def find(self, domain):
+        result = {}
+
+        if not self.open():
+            return result
+
+        domainKey = self.getDomainKey(domain)
+
+        # too short to have a trigram
+        if len(domainKey) < 3:
+            return result
+
+        bestSimilarity = 0
+        bestRow = None
+
+        for row in self.getCandidates(domainKey):
+            similarity = self.compare.domainSimilarity(domain, row['name'], row['status'])
+
+            if similarity > bestSimilarity:
+                bestSimilarity = similarity
+                bestRow = row
+
+        if not bestRow or bestSimilarity < self.minimumSimilarity:
+            self.log.debug(f'No good match for {domain} in the local companies house index')
+            return result
+
+        result = {
+            'companyName': bestRow['name'],
+            'companyNumber': bestRow['number'],
+            'registered office address': bestRow['address'],
+            'company status': bestRow['status']
+        }
+
+        self.log.debug(f'Found {domain} in the local companies house index')
+
+        return result
+
+    # the companies that share the most trigrams with the domain. rare trigrams count for more.
+    def getCandidates(self, domainKey):
+        trigrams = []
+
+        for i in range(0, len(domainKey) - 2):
+            trigram = domainKey[i:i + 3]
+
+            if not trigram in trigrams:
+                trigrams.append(trigram)
+
+        query = ' OR '.join([f'"{trigram}"' for trigram in trigrams])
+
+        return self.connection.execute('select company.* from companyTrigram join company on company.rowid = companyTrigram.rowid where companyTrigram match ? order by rank limit ?', (query, self.maximumCandidates)).fetchall()
+
+    def getDomainKey(self, domain):
+        return helpers.lettersAndNumbersOnly(self.compare.getBasicDomain(domain))
+
+    # the way the scorers see the name, without spaces because domains don't have them
+    def getBasicName(self, name):
+        return self.compare.getBasicCompanyName(name).replace(' ', '')
+
+    # prune is only for the whole register in one file. the multi-part files each have only some of the companies.
+    def importFile(self, fileName, force=False, prune=False):
+        started = time.monotonic()
+
+        self.open(True)
+
+        size = os.path.getsize(fileName)
+
+        row = self.connection.execute('select * from import where file = ? and size = ?', (os.path.basename(fileName), size)).fetchone()
+
+        if row and not force:
+            self.log.info(f'Already imported {fileName} on {row["importedAt"]}. Use --force to import it again.')
+            return
+
+        self.log.info(f'Importing {fileName}')
+
+        # nothing else uses it during the import
+        self.connection.execute('pragma synchronous = off')
+
+        self.connection.execute('drop table if exists temp.seen')
+        self.connection.execute('create temp table seen ( number text primary key )')
+
+        rows = 0
+        changed = 0
+        batch = []
+
+        for row in helpers.readCsvFile(fileName):
+            item = self.getItem(row)
+
+            if not item:
+                continue
+
+            batch.append(item)
+
+            if len(batch) >= self.batchSize:
+                rows += len(batch)
+                changed += self.importBatch(batch)
+                batch = []
+
+                self.log.info(f'Imported {rows} companies')
+
+        rows += len(batch)
+        changed += self.importBatch(batch)
+
+        removed = 0
+
+        # companies that aren't in the new file have been removed from the register
+        if prune:
+            removed = self.connection.execute('delete from company where number not in (select number from temp.seen)').rowcount
+
+        self.connection.execute('drop table temp.seen')
+
+        self.connection.execute('insert or replace into import (file, size, rows, changed, removed, importedAt) values (?, ?, ?, ?, ?, ?)',
+            (os.path.basename(fileName), size, rows, changed, removed, str(datetime.datetime.utcnow())))
+
+        self.connection.commit()
+
+        self.connection.execute('pragma synchronous = normal')
+
+        self.log.info(f'Done. {rows} companies. {changed} new or changed. {removed} removed. Took {int(time.monotonic() - started)} seconds.')
+
+    def importBatch(self, batch):
+        if not batch:
+            return 0
+
+        # only writes the companies that changed since the last import
+        # the basic name changes if ignoreInCompanyName does
+        changed = self.connection.executemany('''insert into company (number, name, basicName, status, address, hash) values (?, ?, ?, ?, ?, ?)
+            on conflict (number) do update set name = excluded.name, basicName = excluded.basicName, status = excluded.status, address = excluded.address, hash = excluded.hash
+            where company.hash != excluded.hash or company.basicName is not excluded.basicName''', batch).rowcount
+
+        self.connection.executemany('insert or ignore into temp.seen (number) values (?)', [(item[0],) for item in batch])
+
+        self.connection.commit()
+
+        # not total_changes because that counts what the triggers write too
+        return changed
+
+    def getItem(self, row):
+        # some column names start with a space
+        row = {key.strip(): value for key, value in row.items() if key}
+
+        number = get(row, 'CompanyNumber').strip()
+        name = get(row, 'CompanyName').strip()
+
+        if not number or not name:
+            return None
+
+        addressFields = [
+            'RegAddress.CareOf',
+            'RegAddress.POBox',
+            'RegAddress.AddressLine1',
+            'RegAddress.AddressLine2',
+            'RegAddress.PostTown',
+            'RegAddress.County',
+            'RegAddress.Country',
+            'RegAddress.PostCode'
+        ]
+
+        address = []
+
+        for field in addressFields:
+            value = get(row, field).strip()
+
+            if value:
+                address.append(value)
+
+        address = ', '.join(address)
+        status = get(row, 'CompanyStatus').strip()
+
+        hash = zlib.crc32(f'{name}\t{status}\t{address}'.encode('utf-8'))
+
+        return (number, name, self.getBasicName(name), status, address, hash)
+
+    def getStatistics(self):
+        if not self.open():
+            return {}
+
+        result = {
+            'companies': self.connection.execute('select count(*) from company').fetchone()[0]
+        }
+
+        row = self.connection.execute('select * from import order by importedAt desc limit 1').fetchone()
+
+        if row:
+            result['lastImport'] = dict(row)
+
+        return result
+
+    # returns false if there's no index yet
+    def open(self, create=False):
+        if self.connection:
+            return True
+
+        if not create and not os.path.exists(self.fileName):
+            return False
+
+        helpers.makeDirectory(os.path.dirname(self.fileName) or '.')
+
+        # the asyncio engine calls find from a thread pool
+        self.connection = sqlite3.connect(self.fileName, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        self.connection.execute('pragma journal_mode = wal')
+
+        # also upgrades an index made by an older version
+        self.makeTables()
+
+        return True
+
+    def makeTables(self):
+        self.connection.execute('create table if not exists company ( number text, name text, basicName text, status text, address text, hash integer, primary key(number) )')
+        self.connection.execute('create table if not exists import ( file text, size integer, rows integer, changed integer, removed integer, importedAt text, primary key(file, size) )')
+
+        columns = [row['name'] for row in self.connection.execute('pragma table_info(company)').fetchall()]
+
+        # made before the trigram index existed. the next import fills it in.
+        if not 'basicName' in columns:
+            self.connection.execute('alter table company add column basicName text')
+
+            self.log.info(f'Import the file again with --force to find companies in {self.fileName}')
+
+        hasTrigrams = self.connection.execute("select name from sqlite_master where name = 'companyTrigram'").fetchone()
+
+        # the trigrams of each basic name point to the company
+        if not hasTrigrams:
+            self.connection.execute("create virtual table companyTrigram using fts5 ( basicName, content = 'company', content_rowid = 'rowid', tokenize = 'trigram' )")
+
+            # the triggers below assume every company is already in it
+            self.connection.execute("insert into companyTrigram (companyTrigram) values ('rebuild')")
+
+        # keep it up to date when companies change
+        self.connection.execute('''create trigger if not exists companyInserted after insert on company begin
+            insert into companyTrigram (rowid, basicName) values (new.rowid, new.basicName);
+            end''')
+
+        self.connection.execute('''create trigger if not exists companyDeleted after delete on company begin
+            insert into companyTrigram (companyTrigram, rowid, basicName) values ('delete', old.rowid, old.basicName);
+            end''')
+
+        self.connection.execute('''create trigger if not exists companyUpdated after update of basicName on company begin
+            insert into companyTrigram (companyTrigram, rowid, basicName) values ('delete', old.rowid, old.basicName);
+            insert into companyTrigram (rowid, basicName) values (new.rowid, new.basicName);
+            end''')
+
+        self.connection.commit()
+
+        return True
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def __init__(self, options, compare=None):
+        self.options = options
+        self.compare = compare
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.fileName = get(options, 'companiesHouseIndexFile') or 'user-data/companies-house.sqlite'
+        self.minimumSimilarity = float(get(options, 'companiesHouseIndexMinimumMatch') or 0.8)
+        self.maximumCandidates = 50
+        self.batchSize = 10000
+        self.connection = None
+
+def main():
+    parser = argparse.ArgumentParser(description='Imports the companies house "basic company data" file. Get it from http://download.companieshouse.gov.uk/en_output.html')
+    parser.add_argument('--import', dest='fileName', help='zip, gzip or csv file to import. importing a newer file updates the index.')
+    parser.add_argument('--force', action='store_true', help='import the file even if it was imported before')
+    parser.add_argument('--prune', action='store_true', help='remove companies that are not in the file. only use it with the file that has every company.')
+    parser.add_argument('--find', help='domain to look up')
+    parser.add_argument('--optionsFile', default='user-data/options.ini')
+
+    arguments = parser.parse_args()
+
+    helpers.setUpLogging('user-data/logs')
+
+    options = {
+        'ignoreInCompanyName': '',
+        'companiesHouseIndexFile': 'user-data/companies-house.sqlite',
+        'companiesHouseIndexMinimumMatch': 0.8
+    }
+
+    helpers.setOptions(arguments.optionsFile, options)
+
+    from .name_finder import Compare
+
+    index = CompaniesHouseIndex(options, Compare(options))
+
+    if arguments.fileName:
+        index.importFile(arguments.fileName, arguments.force, arguments.prune)
+
+    if arguments.find:
+        logging.info(index.find(arguments.find))
+
+    logging.info(index.getStatistics())
+
+    index.close()
+
+if __name__ == '__main__':
+    main()
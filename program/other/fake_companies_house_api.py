@@ -0,0 +1,230 @@
+import re
+import time
+import json
+import base64
+import random
+import logging
+import argparse
+import threading
+import urllib.parse
+import http.server
+import socketserver
+
+from ..library import helpers
+
+from ..library.helpers import get
+
+# a local stand-in for the companies house api. for trying out companiesHouseSource=api without a key or internet.
+# example: python3 -m program.other.fake_companies_house_api --port 8898 --limit 600 --window 300
+# then set companiesHouseApiUrl to http://127.0.0.1:8898 and companiesHouseApiKey to anything in options.ini
+
+sampleCompanies = [
+    ('00445790', 'TESCO PLC', 'active', 'Tesco House, Shire Park, Kestrel Way', 'Welwyn Garden City', 'AL7 1GA'),
+    ('00233462', 'JOHN LEWIS PLC', 'active', '1 Drummond Gate', 'London', 'SW1V 2QQ'),
+    ('03977902', 'GOOGLE UK LIMITED', 'active', 'Belgrave House, 76 Buckingham Palace Road', 'London', 'SW1W 9TQ'),
+    ('01234567', 'ACME WIDGETS LIMITED', 'active', '1 Example Street', 'Leeds', 'LS1 1AA'),
+    ('07654321', 'ACME WIDGETS (NORTH) LTD', 'dissolved', '2 Example Road', 'York', 'YO1 1AA'),
+    ('09876543', 'BLUE SKY BAKERY LTD', 'liquidation', 'Unit 3, Old Mill', 'Bristol', 'BS1 2AB')
+]
+
+class FakeCompaniesHouseApiHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        settings = self.server.settings
+
+        time.sleep(random.uniform(settings.delay / 2, settings.delay * 1.5))
+
+        key = self.getKey()
+
+        if not key:
+            self.sendJson(401, {'error': 'Invalid Authorization', 'type': 'ch:service'})
+            return
+
+        if not self.server.tryRequest(key):
+            self.sendJson(429, {'error': 'Too many requests', 'type': 'ch:service'}, key)
+            return
+
+        parsed = urllib.parse.urlparse(self.path)
+        parameters = dict(urllib.parse.parse_qsl(parsed.query))
+
+        if parsed.path == '/search/companies':
+            self.sendJson(200, self.server.search(get(parameters, 'q'), int(parameters.get('items_per_page', 20)), int(parameters.get('start_index', 0))), key)
+            return
+
+        companyNumber = helpers.findBetween(parsed.path, '/company/', '', True).upper()
+
+        company = self.server.companies.get(companyNumber)
+
+        if not company or '/' in companyNumber:
+            self.sendJson(404, {'errors': [{'error': 'company-profile-not-found', 'type': 'ch:service'}]}, key)
+            return
+
+        self.sendJson(200, self.server.getProfile(company), key)
+
+    # the user name of basic authentication
+    def getKey(self):
+        try:
+            credentials = helpers.findBetween(self.headers.get('Authorization', ''), 'Basic ', '', True)
+
+            return helpers.findBetween(base64.b64decode(credentials).decode('utf-8'), '', ':', True)
+        except Exception:
+            return ''
+
+    def sendJson(self, statusCode, j, key=''):
+        body = json.dumps(j).encode('utf-8')
+
+        self.send_response(statusCode)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+
+        if key:
+            for name, value in self.server.getLimitHeaders(key).items():
+                self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+class FakeCompaniesHouseApi(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    # same window for each key as the real api
+    def tryRequest(self, key):
+        with self.lock:
+            window = self.getWindow(key)
+
+            if window['used'] >= self.settings.limit:
+                return False
+
+            window['used'] += 1
+
+            return True
+
+    def getWindow(self, key):
+        now = time.time()
+
+        window = self.windows.get(key)
+
+        if not window or now >= window['reset']:
+            window = {
+                'used': 0,
+                'reset': int(now + self.settings.window)
+            }
+
+            self.windows[key] = window
+
+        return window
+
+    def getLimitHeaders(self, key):
+        with self.lock:
+            window = self.getWindow(key)
+
+            return {
+                'X-Ratelimit-Limit': str(self.settings.limit),
+                'X-Ratelimit-Remain': str(max(self.settings.limit - window['used'], 0)),
+                'X-Ratelimit-Reset': str(window['reset']),
+                'X-Ratelimit-Window': f'{int(self.settings.window)}s'
+            }
+
+    # companies whose name has any of the words, most matching words first
+    def search(self, query, itemsPerPage, startIndex):
+        words = re.findall('[a-z0-9]+', query.lower())
+
+        matches = []
+
+        for company in self.companies.values():
+            nameWords = re.findall('[a-z0-9]+', company[1].lower())
+
+            score = len([word for word in words if word in nameWords])
+
+            # like the real search, finds "acmewidgets" in "ACME WIDGETS"
+            if helpers.lettersAndNumbersOnly(query.lower()) in ''.join(nameWords):
+                score += len(words) + 1
+
+            if score:
+                matches.append((score, company))
+
+        matches.sort(key=lambda item: -item[0])
+
+        items = []
+
+        for score, company in matches[startIndex:startIndex + itemsPerPage]:
+            items.append({
+                'kind': 'searchresults#company',
+                'company_number': company[0],
+                'title': company[1],
+                'company_status': company[2],
+                'address_snippet': ', '.join([part for part in company[3:] if part])
+            })
+
+        return {
+            'kind': 'search#companies',
+            'total_results': len(matches),
+            'items_per_page': itemsPerPage,
+            'start_index': startIndex,
+            'items': items
+        }
+
+    def getProfile(self, company):
+        return {
+            'company_number': company[0],
+            'company_name': company[1],
+            'company_status': company[2],
+            'type': 'ltd',
+            'registered_office_address': {
+                'address_line_1': company[3],
+                'locality': company[4],
+                'postal_code': company[5]
+            }
+        }
+
+    # the same "basic company data" file that companies_house_index imports
+    def loadFile(self, fileName):
+        for row in helpers.readCsvFile(fileName):
+            row = {key.strip(): value for key, value in row.items() if key}
+
+            number = get(row, 'CompanyNumber').strip()
+
+            if not number:
+                continue
+
+            self.companies[number] = (number, get(row, 'CompanyName').strip(), get(row, 'CompanyStatus').strip().lower().replace(' ', '-'), get(row, 'RegAddress.AddressLine1').strip(), get(row, 'RegAddress.PostTown').strip(), get(row, 'RegAddress.PostCode').strip())
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.companies = {}
+
+        for company in sampleCompanies:
+            self.companies[company[0]] = company
+
+        if settings.file:
+            self.loadFile(settings.file)
+
+        super().__init__(('127.0.0.1', settings.port), FakeCompaniesHouseApiHandler)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8898)
+    parser.add_argument('--delay', type=float, default=0.1, help='average seconds to wait before answering')
+    parser.add_argument('--limit', type=int, default=600, help='requests allowed per window for each key')
+    parser.add_argument('--window', type=float, default=300, help='seconds in each window')
+    parser.add_argument('--file', help='zip, gzip or csv "basic company data" file to serve instead of only a few sample companies')
+
+    settings = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    server = FakeCompaniesHouseApi(settings)
+
+    logging.info(f'Fake Companies House API with {len(server.companies)} companies listening on 127.0.0.1:{settings.port}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
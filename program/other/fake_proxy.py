@@ -0,0 +1,147 @@
+import time
+import random
+import select
+import socket
+import logging
+import argparse
+import urllib.error
+import urllib.request
+import http.server
+import socketserver
+
+# a local proxy that is slow, fails or shows a captcha on purpose. for trying out the proxy pool.
+# example: python3 -m program.other.fake_proxy --port 8899 --delay 0.5 --captchaRate 0.2 --failureRate 0.1
+# then put 127.0.0.1,8899,, in user-data/proxies.csv
+# https is a tunnel the proxy can't look into, so there a captcha refuses the tunnel and the search sees an error.
+# to get real captcha pages, also set defaultSearchUrl to http://www.google.com in options.ini.
+
+captchaPage = '<html><body><form id="captcha-form">Our systems have detected unusual traffic from your computer network.</form></body></html>'
+
+class FakeProxyHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.misbehave():
+            return
+
+        try:
+            request = urllib.request.Request(self.path, headers=self.getHeaders())
+
+            with urllib.request.urlopen(request, timeout=30) as response:
+                body = response.read()
+                status = response.status
+                headers = response.getheaders()
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+            headers = e.headers.items()
+        except Exception as e:
+            self.send_error(502, str(e))
+            return
+
+        self.send_response(status)
+
+        for name, value in headers:
+            if name.lower() not in ['transfer-encoding', 'connection', 'content-length']:
+                self.send_header(name, value)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_CONNECT(self):
+        if self.misbehave():
+            return
+
+        host, port = self.path.split(':')
+
+        try:
+            remote = socket.create_connection((host, int(port)), timeout=30)
+        except Exception as e:
+            self.send_error(502, str(e))
+            return
+
+        self.send_response(200, 'Connection established')
+        self.end_headers()
+
+        connections = [self.connection, remote]
+
+        try:
+            while True:
+                readable, _, errors = select.select(connections, [], connections, 30)
+
+                if errors or not readable:
+                    break
+
+                for connection in readable:
+                    data = connection.recv(65536)
+
+                    if not data:
+                        return
+
+                    other = remote if connection is self.connection else self.connection
+                    other.sendall(data)
+        finally:
+            remote.close()
+
+    # returns true if the request was answered already
+    def misbehave(self):
+        settings = self.server.settings
+
+        time.sleep(random.uniform(settings.delay / 2, settings.delay * 1.5))
+
+        if random.random() < settings.failureRate:
+            self.send_error(503, 'Fake failure')
+            return True
+
+        if random.random() < settings.captchaRate:
+            body = captchaPage.encode('utf-8')
+
+            self.send_response(429)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return True
+
+        return False
+
+    def getHeaders(self):
+        result = {}
+
+        for name, value in self.headers.items():
+            if name.lower() not in ['proxy-connection', 'proxy-authorization', 'connection', 'host']:
+                result[name] = value
+
+        return result
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+class FakeProxy(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings):
+        self.settings = settings
+
+        super().__init__(('127.0.0.1', settings.port), FakeProxyHandler)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--delay', type=float, default=0.5, help='average seconds to wait before answering')
+    parser.add_argument('--captchaRate', type=float, default=0.2, help='fraction of requests that get a captcha page. https tunnels are refused instead.')
+    parser.add_argument('--failureRate', type=float, default=0.1, help='fraction of requests that get a 503 response')
+
+    settings = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logging.info(f'Fake proxy listening on 127.0.0.1:{settings.port}')
+
+    server = FakeProxy(settings)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,11 @@ import sys
 import logging
 import json
 import re
+import threading
+import hashlib
+import math
+import asyncio
+import functools
 
 from datetime import datetime
 
@@ -13,17 +18,74 @@ from ..library import helpers
 
 from ..library.helpers import get
 from ..library.database import Database
+from ..library.database import runInDatabaseThread
 from ..library.website import Website
 from ..library.api import Api
+from ..library.api import AsyncApi
 from ..library.google import Google
 from ..library.other import Internet
 from ..library.sites.google_maps import GoogleMaps
+from ..library.output import getOutputs
+from ..library.cache import companyCache
+from .companies_house_index import CompaniesHouseIndex
+from .companies_house_api import CompaniesHouseApi
 
 class NameFinder:
     def findName(self, domain):
-        if self.isDone(domain) or not domain:
+        newItem = self.startDomain(domain)
+
+        if not newItem:
+            return
+
+        companiesHouseInformation = self.lookOnCompaniesHouse(domain)
+
+        if self.google.captcha:
+            self.captcha = True
+            return
+
+        # can stop early to speed things up
+        if self.checkCompaniesHouse(newItem, companiesHouseInformation):
+            return
+
+        # does website title match the name in companies house?
+        websiteInformation = self.lookOnWebsite(domain)
+
+        if self.google.captcha:
+            self.captcha = True
+            return
+
+        self.checkWebsite(newItem, companiesHouseInformation, websiteInformation)
+
+    # the database, caches and parsing run in other threads so the event loop keeps going
+    async def findNameAsync(self, domain):
+        newItem = await runInDatabaseThread(self.startDomain, domain)
+
+        if not newItem:
             return
 
+        companiesHouseInformation = await self.lookOnCompaniesHouseAsync(domain)
+
+        if self.google.captcha:
+            self.captcha = True
+            return
+
+        # can stop early to speed things up
+        if await runInDatabaseThread(self.checkCompaniesHouse, newItem, companiesHouseInformation):
+            return
+
+        # does website title match the name in companies house?
+        websiteInformation = await self.lookOnWebsiteAsync(domain)
+
+        if self.google.captcha:
+            self.captcha = True
+            return
+
+        await runInDatabaseThread(self.checkWebsite, newItem, companiesHouseInformation, websiteInformation)
+
+    def startDomain(self, domain):
+        if self.isDone(domain) or not domain:
+            return {}
+
         newItem = {
             'domain': domain,
             'companyName': 'unknown'
@@ -34,10 +96,10 @@ class NameFinder:
         self.compare.reset()
         self.compare.domain = domain
 
-        companiesHouseInformation = self.lookOnCompaniesHouse(domain)
+        return newItem
 
-        if self.google.captcha:
-            return
+    def checkCompaniesHouse(self, newItem, companiesHouseInformation):
+        domain = self.domain
 
         if companiesHouseInformation:
             # does "a b c" match "abc.com"?
@@ -47,17 +109,9 @@ class NameFinder:
             noSpacesSimilarity = self.compare.companyNameMatchesDomain(domain, get(companiesHouseInformation, 'companyName'), 'by no spaces')
             self.compare.increaseConfidence(noSpacesSimilarity * 400, 400, f'The domain name matches the name in companies house.', f'domain name matches companies house')
 
-        # can stop early to speed things up
-        if self.outputIfDone(newItem, companiesHouseInformation):
-            return
-
-        # does website title match the name in companies house?
-        websiteInformation = self.lookOnWebsite(domain)
-
-        if self.google.captcha:
-            self.captcha = True
-            return
+        return self.outputIfDone(newItem, companiesHouseInformation)
 
+    def checkWebsite(self, newItem, companiesHouseInformation, websiteInformation):
         if self.domainStatus != 'active':
             self.outputUnknown(newItem, companiesHouseInformation)
             return
@@ -84,8 +138,6 @@ class NameFinder:
 
         self.outputUnknown(newItem, companiesHouseInformation)
 
-        helpers.wait(self.options['secondsBetweenLines'], self.log.name)
-
     def outputUnknown(self, newItem, companiesHouseInformation):
         toOutput = helpers.mergeDictionaries(companiesHouseInformation, newItem)
         
@@ -120,15 +172,43 @@ class NameFinder:
         return True
 
     def lookOnWebsite(self, domain):
-        result = {}
+        response = self.api.get(self.getWebsiteUrl(domain), None, False, True)
+        
+        self.domainStatus = self.getDomainStatus(domain, response)
+
+        if not self.domainStatus:
+            if self.hasResultsOnGoogle(domain):
+                self.domainStatus = 'active'
+            else:
+                self.log.debug(f'{domain} only has 1 or 0 results on Google')
+                self.domainStatus = 'parked'
+
+        return self.getWebsiteInformation(domain, response)
+
+    async def lookOnWebsiteAsync(self, domain):
+        response = await self.asyncApi.get(self.getWebsiteUrl(domain), None, False, True)
+        
+        self.domainStatus = self.getDomainStatus(domain, response)
+
+        if not self.domainStatus:
+            if await self.hasResultsOnGoogleAsync(domain):
+                self.domainStatus = 'active'
+            else:
+                self.log.debug(f'{domain} only has 1 or 0 results on Google')
+                self.domainStatus = 'parked'
+
+        return await asyncio.to_thread(self.getWebsiteInformation, domain, response)
 
+    def getWebsiteUrl(self, domain):
         url = domain
 
         if not domain.startswith('https://') and not domain.startswith('http://'):
             url = 'http://' + url
-        
-        response = self.api.get(url, None, False, True)
-        
+
+        return url
+
+    # returns an empty string if it depends on the number of results on google
+    def getDomainStatus(self, domain, response):
         toAvoid = [
             'page not found',
             'cannot be found',
@@ -138,18 +218,19 @@ class NameFinder:
         ]
 
         if not response or not response.text:
-            self.domainStatus = 'offline'
+            return 'offline'
         elif response.status_code == 404:
-            self.domainStatus = '404 error'
+            return '404 error'
         elif helpers.substringIsInList(toAvoid, response.text):
             self.log.debug(f'{domain} contains string to avoid')
-            self.domainStatus = 'parked'
-        elif not self.hasResultsOnGoogle(domain):
-            self.log.debug(f'{domain} only has 1 or 0 results on Google')
-            self.domainStatus = 'parked'            
-        else:
-            self.domainStatus = 'active'
+            return 'parked'
+
+        return ''
 
+    def getWebsiteInformation(self, domain, response):
+        result = {}
+
+        if self.domainStatus == 'active':
             document = lh.fromstring(response.content)
             title = self.website.getXpath('', "//title", True, None, document)
 
@@ -178,10 +259,78 @@ class NameFinder:
         return result
 
     def lookOnCompaniesHouse(self, domain):
-        result = {}
+        # no network needed if the local copy has a good match
+        result = self.companiesHouseIndex.find(domain)
+
+        if result:
+            self.log.info(f'Name from Companies House: {get(result, "companyName")}')
+            return result
+
+        # no google needed
+        if self.companiesHouseApi:
+            result = self.companiesHouseApi.find(domain)
+
+            self.log.info(f'Name from Companies House: {get(result, "companyName")}')
+
+            return result
+
+        # might have been found by another worker's search
+        self.google.captcha = False
+
+        url = companiesHouseBatches.getUrl(domain, self)
+
+        if self.google.captcha:
+            return result
+
+        if url == None:
+            googleResults = self.google.search(f'site:beta.companieshouse.gov.uk {domain}', 5, False)
 
-        googleResults = self.google.search(f'site:beta.companieshouse.gov.uk {domain}', 5, False)
+            url = self.getCompaniesHouseUrl(googleResults)
 
+        if url:
+            result = self.getCompaniesHouseInformation(url)
+
+        self.log.info(f'Name from Companies House: {get(result, "companyName")}')
+        
+        return result
+
+    async def lookOnCompaniesHouseAsync(self, domain):
+        # no network needed if the local copy has a good match
+        result = await asyncio.to_thread(self.companiesHouseIndex.find, domain)
+
+        if result:
+            self.log.info(f'Name from Companies House: {get(result, "companyName")}')
+            return result
+
+        # no google needed
+        if self.companiesHouseApi:
+            result = await self.companiesHouseApi.findAsync(domain)
+
+            self.log.info(f'Name from Companies House: {get(result, "companyName")}')
+
+            return result
+
+        # might have been found by another worker's search
+        self.google.captcha = False
+
+        url = await companiesHouseBatches.getUrlAsync(domain, self)
+
+        if self.google.captcha:
+            return result
+
+        if url == None:
+            googleResults = await self.google.searchAsync(f'site:beta.companieshouse.gov.uk {domain}', 5, False)
+
+            url = self.getCompaniesHouseUrl(googleResults)
+
+        if url:
+            result = await self.getCompaniesHouseInformationAsync(url)
+
+        self.log.info(f'Name from Companies House: {get(result, "companyName")}')
+        
+        return result
+
+    def getCompaniesHouseUrl(self, googleResults):
         for googleResult in googleResults:
             if googleResult == 'no results':
                 break
@@ -195,48 +344,88 @@ class NameFinder:
             if not companyId:
                 continue
 
-            url = 'https://beta.companieshouse.gov.uk/company/' + companyId
+            return 'https://beta.companieshouse.gov.uk/company/' + companyId
 
-            result = self.getCompaniesHouseInformation(url)
-
-            break
-
-        self.log.info(f'Name from Companies House: {get(result, "companyName")}')
-        
-        return result
+        return ''
     
     def getCompaniesHouseInformation(self, companiesHouseUrl):
-        result = {}
+        companyNumber = self.getCompanyNumber(companiesHouseUrl)
 
-        api = Api()
-        response = api.get(companiesHouseUrl, None, False, True)
+        # several domains often belong to the same company
+        result = companyCache.get(companyNumber)
 
-        if not response or not response.content:
+        if result != None:
             return result
 
-        website = Website(self.options)
+        response = self.companyPageApi.get(companiesHouseUrl, None, False, True, cache=True)
+
+        return self.getCompaniesHouseInformationFromResponse(response, companyNumber)
+
+    async def getCompaniesHouseInformationAsync(self, companiesHouseUrl):
+        companyNumber = self.getCompanyNumber(companiesHouseUrl)
+
+        result = await asyncio.to_thread(companyCache.get, companyNumber)
+
+        if result != None:
+            return result
+
+        response = await self.companyPageAsyncApi.get(companiesHouseUrl, None, False, True, cache=True)
+
+        return await asyncio.to_thread(self.getCompaniesHouseInformationFromResponse, response, companyNumber)
+
+    def getCompanyNumber(self, companiesHouseUrl):
+        return helpers.findBetween(companiesHouseUrl, '/company/', '/', True) or helpers.findBetween(companiesHouseUrl, '/company/', '', True)
+
+    # reads everything it needs in one pass over the page
+    def getCompaniesHouseInformationFromResponse(self, response, companyNumber=''):
+        result = {}
+
+        if not response or not response.content:
+            return result
 
         document = lh.fromstring(response.content)
 
-        name = website.getXpath('', "//div[@class = 'company-header']//p[@class = 'heading-xlarge']", True, None, document)
-        companyNumber = website.getXpath('', "//p[@id = 'company-number']/strong", True, None, document)
-        
         result = {
-            'companyName': name,
-            'companyNumber': companyNumber
+            'companyName': '',
+            'companyNumber': ''
         }
 
-        pairs = website.getXpath('', "//dl", False, None, document)
+        details = {}
+
+        for element in document.iter('p', 'dl'):
+            if element.tag == 'dl':
+                term = self.getFirstText(element, 'dt')
+
+                if term == 'Registered office address' or term == 'Company status':
+                    details[term.lower()] = self.getFirstText(element, 'dd')
+            elif not result['companyName'] and element.get('class') == 'heading-xlarge' and self.isInCompanyHeader(element):
+                result['companyName'] = element.text_content().strip()
+            elif not result['companyNumber'] and element.get('id') == 'company-number':
+                for strong in element.iterchildren('strong'):
+                    result['companyNumber'] = strong.text_content().strip()
+                    break
 
-        for pair in pairs:
-            term = website.getXpathInElement(pair, ".//dt", True)            
-            definition = website.getXpathInElement(pair, ".//dd", True)
+        result.update(details)
 
-            if term == 'Registered office address' or term == 'Company status':
-                result[term.lower()] = definition
+        # don't keep error pages
+        if result['companyName']:
+            companyCache.put(companyNumber or result['companyNumber'], result)
 
         return result
 
+    def getFirstText(self, element, tag):
+        for child in element.iter(tag):
+            return child.text_content().strip()
+
+        return ''
+
+    def isInCompanyHeader(self, element):
+        for ancestor in element.iterancestors('div'):
+            if ancestor.get('class') == 'company-header':
+                return True
+
+        return False
+
     def outputResult(self, newItem):
         if not get(newItem, 'domain'):
             return
@@ -246,29 +435,7 @@ class NameFinder:
         else:
             self.log.info(f'No result found for {get(newItem, "domain")}')
 
-        outputFile = self.options['outputFile']
-
-        helpers.makeDirectory(os.path.dirname(outputFile))
-
-        fields = ['domain', 'companyName', 'confidence', 'companyNumber', 'registered office address', 'company status', 'domainStatus']
-
-        if not os.path.exists(outputFile):
-            printableFields = []
-            
-            for field in fields:
-                printableName = helpers.addBeforeCapitalLetters(field).lower()
-                
-                printableFields.append(printableName)
-            
-            helpers.toFile(','.join(printableFields), outputFile)
-
-        values = []
-
-        for field in fields:
-            values.append(get(newItem, field))
-
-        # this quote fields that contain commas
-        helpers.appendCsvFile(values, outputFile)
+        self.output.write(newItem)
 
         self.toDatabase(newItem)
 
@@ -285,19 +452,53 @@ class NameFinder:
 
         self.database.insert('result', toStore)
 
+        self.doneDomains.add(get(newItem, 'domain'))
+
     def hasResultsOnGoogle(self, domain):
-        results = self.google.search(f'site:{domain}')
+        return self.google.countResults(f'site:{domain}', 2) > 1
 
-        return len(results) > 1
+    async def hasResultsOnGoogleAsync(self, domain):
+        return await self.google.countResultsAsync(f'site:{domain}', 2) > 1
     
     def isDone(self, domain):
-        if self.database.getFirst('result', 'domain', f"domain = '{domain}'"):
+        if self.doneDomains.contains(domain, self.database):
             self.log.info(f'Skipping. Already done {domain}.')
             return True
 
         return False
 
-    def __init__(self, options, database):
+    def getOutput(self):
+        fields = ['domain', 'companyName', 'confidence', 'companyNumber', 'registered office address', 'company status', 'domainStatus']
+
+        printableFields = []
+        
+        for field in fields:
+            printableName = helpers.addBeforeCapitalLetters(field).lower()
+            
+            printableFields.append(printableName)
+
+        return getOutputs(self.options, fields, printableFields, ['confidence'])
+
+    def getCredentials(self):
+        if not self.credentials:
+            url =  helpers.getFile('program/resources/resource2')
+            externalApi = Api()
+
+            self.credentials = {
+                'google maps': {
+                    'apiKey': externalApi.get(url, None, False)
+                }
+            }
+
+        return self.credentials
+
+    def getGoogleMaps(self):
+        if not self.googleMaps:
+            self.googleMaps = GoogleMaps(self.options, self.getCredentials(), self.database)
+
+        return self.googleMaps
+
+    def __init__(self, options, database, doneDomains=None, output=None):
         self.options = options
         self.log = logging.getLogger(get(self.options, 'loggerName'))
         self.database = database
@@ -306,24 +507,66 @@ class NameFinder:
         self.tablesFile = 'program/resources/tables.json'
         self.database.makeTables(self.tablesFile)
 
-        self.credentials = {
-            'google maps': {}
-        }
+        # workers share one copy
+        self.doneDomains = doneDomains
+
+        if not self.doneDomains:
+            self.doneDomains = DoneDomains(self.options)
+            self.doneDomains.load(self.database)
 
-        url =  helpers.getFile('program/resources/resource2')
-        externalApi = Api()
-        self.credentials['google maps']['apiKey'] = externalApi.get(url, None, False)
+        self.output = output
+
+        if not self.output:
+            self.output = self.getOutput()
+
+        self.database.beforeCommit = self.output.sync
+
+        # findName doesn't need these, so they're only made when something asks for them
+        self.credentials = None
+        self.googleMaps = None
 
         self.compare = Compare(self.options)
+        self.companiesHouseIndex = CompaniesHouseIndex(self.options, self.compare)
         self.internet = Internet(self.options)
         self.api = Api('', self.options)
         self.api.timeout = 5
+        self.asyncApi = AsyncApi('', self.options)
+        self.asyncApi.timeout = 5
         self.website = Website(self.options)
+        self.companyPageApi = Api()
+        self.companyPageAsyncApi = AsyncApi()
+        self.companiesHouseApi = None
+
+        if get(self.options, 'companiesHouseSource') == 'api':
+            self.companiesHouseApi = CompaniesHouseApi(self.options, self.compare)
+
         self.google = Google(self.options)
         self.google.internet = self.internet
-        self.googleMaps = GoogleMaps(self.options, self.credentials, self.database)
 
 class Compare:
+    # how much of the domain the company name covers, from 0 to 1. active companies win ties.
+    # not "by words", because that's how much of the name is in the domain. "acme" would match acmewidgets.co.uk.
+    def domainSimilarity(self, domain, name, status=''):
+        similarity = self.companyNameMatchesDomain(self.getBareDomain(domain), name, 'by no spaces')
+
+        if status.lower() == 'active':
+            similarity += 0.001
+
+        return similarity
+
+    # "www.Acme-Widgets.co.uk" becomes "acme-widgets.co.uk"
+    def getBareDomain(self, domain):
+        domain = domain.lower()
+
+        if domain.startswith('www.'):
+            domain = domain[4:]
+
+        return domain
+
+    # "www.Acme-Widgets.co.uk" becomes "acme-widgets"
+    def getBasicDomain(self, domain):
+        return helpers.getBasicDomainName(self.getBareDomain(domain))
+
     def companyNameMatchesDomain(self, domain, name, mode):
         name = self.getBasicCompanyName(name)
 
@@ -411,12 +654,13 @@ class Compare:
         result = result.strip()
         return helpers.squeezeWhitespace(result)
 
+    # called for the same few names many times per domain
     def getBasicCompanyName(self, s):
+        return self.basicCompanyNames(s)
+
+    def makeBasicCompanyName(self, s):
         # description or extraneous information usually comes after
-        s = helpers.findBetween(s, '', '|')
-        s = helpers.findBetween(s, '', ' - ')
-        s = helpers.findBetween(s, '', ',')
-        s = helpers.findBetween(s, '', '(')
+        s = self.descriptionRegex.split(s, 1)[0]
 
         s = s.replace('-', ' ')
         s = s.replace('&', ' ')
@@ -424,6 +668,14 @@ class Compare:
         s = helpers.lettersNumbersAndSpacesOnly(s)
         s = self.getFuzzyVersion(s)
 
+        s = self.ignoreRegex.sub('', s)
+
+        s = self.getFuzzyVersion(s)
+
+        return s
+
+    # suffixes are removed as whole words. a location removes the rest of the name.
+    def getIgnoreRegex(self):
         stringsToIgnore = [
             'limited',
             'ltd',
@@ -436,23 +688,15 @@ class Compare:
             'incorporated'
         ]
 
-        for string in stringsToIgnore:
-            # word with space before and after
-            s = re.sub(f' {string} ', ' ', s)
-            # ends in the string
-            s = re.sub(f' {string}$', '', s)
-
-        locationsToRemove = self.options['ignoreInCompanyName'].split(',')
+        # an empty one would remove everything after the first word
+        locationsToRemove = [string for string in self.options['ignoreInCompanyName'].split(',') if string]
 
-        for string in locationsToRemove:
-            # word with space before and after
-            s = re.sub(f' {string}.*', '', s)
-            # ends in the string
-            s = re.sub(f' {string}$', '', s)
+        pattern = ' (?:' + '|'.join(stringsToIgnore) + ')(?= |$)'
 
-        s = self.getFuzzyVersion(s)
+        if locationsToRemove:
+            pattern += '| (?:' + '|'.join([f'(?:{string})' for string in locationsToRemove]) + ').*'
 
-        return s
+        return re.compile(pattern)
 
     def wordsInARowTheSame(self, words, toCompare, joinString, mustStartWith):
         result = 0
@@ -537,3 +781,277 @@ class Compare:
         self.maximumPossibleConfidence = 0
         self.domain = ''
         self.log = logging.getLogger(get(self.options, 'loggerName'))
+        self.descriptionRegex = re.compile(r'\|| - |,|\(')
+        self.ignoreRegex = self.getIgnoreRegex()
+        self.basicCompanyNames = functools.lru_cache(maxsize=10000)(self.makeBasicCompanyName)
+
+class DoneDomains:
+    def contains(self, domain, database):
+        with self.lock:
+            if self.bloomFilter == None:
+                return domain in self.domains
+
+            if not self.bloomFilter.contains(domain):
+                return False
+
+        # bloom filter can have false positives
+        if database.getFirst('result', 'domain', 'domain = ?', parameters=(domain,)):
+            return True
+
+        return False
+
+    def add(self, domain):
+        if not domain:
+            return
+
+        with self.lock:
+            if self.bloomFilter == None:
+                self.domains.add(domain)
+            else:
+                self.bloomFilter.add(domain)
+
+    def load(self, database):
+        count = database.getFirst('result', 'count(*)', None)
+        count = int(get(count, 'count(*)') or 0)
+
+        # a set needs too much memory for very large tables
+        if count > self.maximumSetSize:
+            self.log.info(f'Using a bloom filter for {count} finished domains')
+            self.bloomFilter = BloomFilter(count * 2, 0.01)
+
+        for row in database.getAll('result', 'domain'):
+            self.add(get(row, 'domain'))
+
+        self.log.debug(f'Loaded {count} finished domains')
+
+    def __init__(self, options):
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.lock = threading.Lock()
+        self.domains = set()
+        self.bloomFilter = None
+        self.maximumSetSize = int(get(options, 'doneSetMaximumSize') or 5000000)
+
+class BloomFilter:
+    def add(self, s):
+        for index in self.getIndexes(s):
+            self.bits[index >> 3] |= 1 << (index & 7)
+
+    def contains(self, s):
+        for index in self.getIndexes(s):
+            if not self.bits[index >> 3] & (1 << (index & 7)):
+                return False
+
+        return True
+
+    def getIndexes(self, s):
+        digest = hashlib.blake2b(s.encode('utf-8'), digest_size=16).digest()
+
+        # double hashing gives as many indexes as needed from one digest
+        first = int.from_bytes(digest[0:8], 'little')
+        second = int.from_bytes(digest[8:16], 'little') | 1
+
+        for i in range(0, self.hashCount):
+            yield (first + i * second) % self.size
+
+    def __init__(self, capacity, falsePositiveRate):
+        capacity = max(capacity, 1)
+
+        self.size = int(-capacity * math.log(falsePositiveRate) / (math.log(2) ** 2))
+        self.size = max(self.size, 8)
+        self.hashCount = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray(self.size // 8 + 1)
+
+class CompaniesHouseBatches:
+    # finds several domains on companies house with one google search. the results are matched to domains by the
+    # snippet and the company name. domains it can't match are searched for on their own.
+    def add(self, domains):
+        if self.batchSize <= 1:
+            return
+
+        with self.condition:
+            for i in range(0, len(domains), self.batchSize):
+                batch = {
+                    'domains': domains[i:i + self.batchSize],
+                    'state': 'waiting',
+                    'urls': {}
+                }
+
+                for domain in batch['domains']:
+                    self.batches[domain] = batch
+
+    # returns none if the domain needs its own search
+    def getUrl(self, domain, nameFinder):
+        with self.condition:
+            batch = self.batches.get(domain)
+
+            if not batch:
+                return None
+
+            # another worker is already searching
+            while batch['state'] == 'searching':
+                self.condition.wait(1)
+
+            searchNow = self.shouldSearch(batch)
+
+        if searchNow:
+            results = []
+
+            try:
+                results = nameFinder.google.searchWithText(self.getQuery(batch), self.getNumberOfResults(batch), False)
+            finally:
+                self.finishSearch(batch, results, nameFinder)
+
+        return self.getResult(domain, batch)
+
+    async def getUrlAsync(self, domain, nameFinder):
+        while True:
+            with self.condition:
+                batch = self.batches.get(domain)
+
+                if not batch:
+                    return None
+
+                if batch['state'] != 'searching':
+                    searchNow = self.shouldSearch(batch)
+                    break
+
+            await asyncio.sleep(0.1)
+
+        if searchNow:
+            results = []
+
+            try:
+                results = await nameFinder.google.searchWithTextAsync(self.getQuery(batch), self.getNumberOfResults(batch), False)
+            finally:
+                self.finishSearch(batch, results, nameFinder)
+
+        return self.getResult(domain, batch)
+
+    # for domains that were found some other way, so they don't stay in memory or take a place in the search
+    def discard(self, domain):
+        if self.batchSize <= 1:
+            return
+
+        with self.condition:
+            batch = self.batches.pop(domain, None)
+
+            if batch and batch['state'] == 'waiting' and domain in batch['domains']:
+                batch['domains'].remove(domain)
+
+    def shouldSearch(self, batch):
+        if batch['state'] != 'waiting':
+            return False
+
+        batch['state'] = 'searching'
+
+        return True
+
+    def finishSearch(self, batch, results, nameFinder):
+        try:
+            # after a captcha the domains are searched for on their own
+            if not nameFinder.google.captcha:
+                self.matchResults(batch, results, nameFinder)
+        except Exception as e:
+            helpers.handleException(e, 'Could not match companies house results')
+        finally:
+            with self.condition:
+                batch['state'] = 'done'
+                self.searches += 1
+
+                self.condition.notify_all()
+
+    def getResult(self, domain, batch):
+        with self.condition:
+            self.batches.pop(domain, None)
+
+            url = batch['urls'].get(domain)
+
+            if url == None:
+                self.notFound += 1
+            else:
+                self.found += 1
+
+            return url
+
+    def getQuery(self, batch):
+        return 'site:beta.companieshouse.gov.uk (' + ' OR '.join(batch['domains']) + ')'
+
+    def getNumberOfResults(self, batch):
+        return max(10, len(batch['domains']) * 2)
+
+    def matchResults(self, batch, results, nameFinder):
+        domains = batch['domains']
+
+        # none of them are on companies house
+        if results == ['no results']:
+            for domain in domains:
+                batch['urls'][domain] = ''
+
+            return
+
+        matches = []
+
+        for result in results:
+            url = nameFinder.getCompaniesHouseUrl([get(result, 'url')])
+
+            if not url:
+                continue
+
+            for domain in domains:
+                similarity = self.getSimilarity(domain, result, nameFinder.compare)
+
+                if similarity >= self.minimumSimilarity:
+                    matches.append((similarity, domain, url))
+
+        # best matches first. each company goes to one domain.
+        matches.sort(key=lambda match: match[0], reverse=True)
+
+        usedUrls = []
+
+        for similarity, domain, url in matches:
+            if domain in batch['urls'] or url in usedUrls:
+                continue
+
+            batch['urls'][domain] = url
+            usedUrls.append(url)
+
+    def getSimilarity(self, domain, result, compare):
+        bareDomain = compare.getBareDomain(domain)
+
+        # the snippet mentions the website. not part of a longer domain like www.bacme.co.uk or acme.co.uk.example.com.
+        if re.search(r'(?<![\w.-])(?:www\.)?' + re.escape(bareDomain) + r'(?![\w-]|\.\w)', get(result, 'text').lower()):
+            return 1
+
+        title = get(result, 'title')
+
+        # for example: EXAMPLE LIMITED overview - Find and update company information - GOV.UK
+        name = helpers.findBetween(title.lower(), '', ' overview', True) or helpers.findBetween(title, '', ' - ', True) or title
+
+        return compare.domainSimilarity(domain, name)
+
+    def getStatistics(self):
+        return {
+            'searches': self.searches,
+            'found': self.found,
+            'notFound': self.notFound
+        }
+
+    def configure(self, options):
+        self.batchSize = int(get(options, 'companiesHouseBatchSize') or 1)
+
+        # the api doesn't search google
+        if get(options, 'companiesHouseSource') == 'api':
+            self.batchSize = 1
+        self.minimumSimilarity = float(get(options, 'companiesHouseBatchMinimumMatch') or 0.8)
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.batches = {}
+        self.batchSize = 1
+        self.minimumSimilarity = 0.8
+        self.searches = 0
+        self.found = 0
+        self.notFound = 0
+
+# shared by all workers
+companiesHouseBatches = CompaniesHouseBatches()
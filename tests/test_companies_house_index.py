@@ -0,0 +1,105 @@
+import sqlite3
+
+from program.other.companies_house_index import CompaniesHouseIndex
+from program.other.name_finder import Compare
+
+header = 'CompanyName, CompanyNumber,RegAddress.AddressLine1,RegAddress.PostTown,CompanyStatus\n'
+
+companies = [
+    ('ACME WIDGETS LIMITED', '01234567', '1 Example Street', 'Leeds', 'Active'),
+    ('BLUE SKY BAKERY LTD', '09876543', 'Unit 3, Old Mill', 'Bristol', 'Liquidation'),
+    ('GREEN ENERGY LTD', '07654321', '2 Example Road', 'York', 'Active'),
+    ('ACME PLUMBING SERVICES LTD', '04567890', '3 Example Lane', 'Hull', 'Active'),
+    ('WIDGETS LTD', '05678901', '4 Example Way', 'Derby', 'Active')
+]
+
+def makeCsvFile(folder, rows):
+    fileName = str(folder / 'BasicCompanyData.csv')
+
+    with open(fileName, 'w') as file:
+        file.write(header)
+
+        for row in rows:
+            file.write(','.join([f'"{value}"' for value in row]) + '\n')
+
+    return fileName
+
+def getIndex(folder):
+    return CompaniesHouseIndex({'companiesHouseIndexFile': str(folder / 'companies-house.sqlite')}, Compare({'ignoreInCompanyName': ''}))
+
+# how the first version of the index stored companies, without basicName or the trigram table
+def makeOldIndex(folder):
+    connection = sqlite3.connect(str(folder / 'companies-house.sqlite'))
+
+    connection.execute('create table company ( number text, name text, key text, status text, address text, hash integer, primary key(number) )')
+    connection.execute('create index companyKey on company (key)')
+    connection.execute('create table import ( file text, size integer, rows integer, changed integer, removed integer, importedAt text, primary key(file, size) )')
+
+    for name, number, line1, town, status in companies:
+        connection.execute('insert into company (number, name, key, status, address, hash) values (?, ?, ?, ?, ?, ?)', (number, name, name.lower().replace(' ', ''), status, f'{line1}, {town}', 0))
+
+    connection.commit()
+    connection.close()
+
+def getLastImport(index):
+    return index.getStatistics()['lastImport']
+
+def test_import_counts_only_new_or_changed_companies(tmp_path):
+    fileName = makeCsvFile(tmp_path, companies)
+
+    index = getIndex(tmp_path)
+    index.importFile(fileName)
+
+    assert getLastImport(index)['rows'] == len(companies)
+    assert getLastImport(index)['changed'] == len(companies)
+
+    index.importFile(fileName, True)
+
+    assert getLastImport(index)['changed'] == 0
+
+    changedCompanies = list(companies)
+    changedCompanies[2] = ('GREEN ENERGY LTD', '07654321', '2 Example Road', 'York', 'Dissolved')
+
+    index.importFile(makeCsvFile(tmp_path, changedCompanies), True)
+
+    assert getLastImport(index)['changed'] == 1
+    assert index.find('greenenergy.co.uk')['company status'] == 'Dissolved'
+
+    index.close()
+
+def test_finds_the_company_that_covers_the_domain(tmp_path):
+    index = getIndex(tmp_path)
+    index.importFile(makeCsvFile(tmp_path, companies))
+
+    assert index.find('acmewidgets.co.uk')['companyNumber'] == '01234567'
+    assert index.find('www.acme-plumbing-services.co.uk')['companyNumber'] == '04567890'
+
+    # only part of the domain
+    assert index.find('acmeplumbingandheating.co.uk') == {}
+    assert index.find('bestwidgets.co.uk') == {}
+
+    index.close()
+
+def test_upgrades_old_index(tmp_path):
+    makeOldIndex(tmp_path)
+
+    index = getIndex(tmp_path)
+
+    # the names aren't indexed until the next import
+    assert index.find('acmewidgets.co.uk') == {}
+
+    index.importFile(makeCsvFile(tmp_path, companies), True)
+
+    assert index.find('acmewidgets.co.uk')['companyNumber'] == '01234567'
+    assert index.find('blueskybakery.com')['company status'] == 'Liquidation'
+
+    index.close()
+
+    connection = sqlite3.connect(str(tmp_path / 'companies-house.sqlite'))
+
+    # raises if the trigram table doesn't match the companies
+    connection.execute("insert into companyTrigram (companyTrigram) values ('integrity-check')")
+
+    assert connection.execute('pragma integrity_check').fetchone()[0] == 'ok'
+
+    connection.close()